@@ -22,9 +22,10 @@ def face_area_compute_variance(fps):
         print("*** TOOK FACE AREA: %s" % area)
         area_folder = os.path.join(EMOTION_PATH, "FaceAreas", area)
         instruments = Training(EmotionArea, prefix=area_folder)
-        instruments.compute_weights(None, None, fps)
-        wvar = instruments.compute_within_variance(fps)
-        bvar = instruments.compute_between_variance(fps)
+        trn_set = instruments.load_train_set(fps)
+        instruments.compute_weights(None, None, fps, trn_set)
+        wvar = instruments.compute_within_variance(fps, trn_set=trn_set)
+        bvar = instruments.compute_between_variance(fps, trn_set=trn_set)
         within_vars.append(wvar)
         between_vars.append(bvar)
     wvar_aver = np.average(within_vars)
@@ -22,8 +22,9 @@ def face_areas_test(fps):
         print("*** TOOK FACE AREA: %s" % area)
         area_folder = os.path.join(EMOTION_PATH, "FaceAreas", area)
         instruments = Testing(EmotionArea, prefix=area_folder)
-        instruments.compute_weights(None, None, fps)
-        one_area_case = instruments.the_worst_comparison(fps)
+        trn_set = instruments.load_train_set(fps)
+        instruments.compute_weights(None, None, fps, trn_set)
+        one_area_case = instruments.the_worst_comparison(fps, trn_set=trn_set)
         the_best_the_worst_the_total.append(one_area_case)
     the_best, the_worst, total = np.sum(the_best_the_worst_the_total, axis=0)
     print("*** FACE AREA TEST IS COMPLETED. ***")
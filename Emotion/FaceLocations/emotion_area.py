@@ -7,6 +7,7 @@ import numpy as np
 import warnings
 from Emotion.em_reader import Emotion, EMOTION_PATH
 from Emotion.FaceLocations.preparation import get_face_areas
+from tools.project_info import load_json, get_weights, REQUIRED
 
 
 isString = lambda item: type(item).__name__ in ("str", "unicode")
@@ -52,9 +53,18 @@ class MultipleActions(object):
 
 
 class EmotionArea(Emotion):
-    def __init__(self, obj_path, fps=None):
+    # norm_data is taken from the area pickle as is
+    cached_arrays = ("data",)
+
+    def __init__(self, obj_path, fps=None, lazy=False):
+        """
+        :param obj_path: path to the area pickle
+        :param fps: new fps to be set
+        :param lazy: ignored; the area pickle holds norm_data,
+                     so it's read at once anyway
+        """
         obj_info = pickle.load(open(obj_path, 'rb'))
-        face_structure = json.load(open("face_structure_merged.json", 'r'))
+        face_structure = load_json("face_structure_merged.json", REQUIRED)
         self.face_area = obj_info["face_area"]
         self.action = obj_info["action"]
         Emotion.__init__(self, obj_path, fps)
@@ -78,12 +88,12 @@ class EmotionArea(Emotion):
         self.frames -= 1
 
     def set_weights(self):
-        proj_info = json.load(open("EMOTION_AREAS_INFO.json", 'r'))
+        proj_info = load_json("EMOTION_AREAS_INFO.json")
         if self.action in proj_info["weights"][self.face_area]:
             if self.action == "(undef)":
                 weights_arr = np.ones(len(self.labels)) * np.nan
             else:
-                weights_arr = proj_info["weights"][self.face_area][self.action]
+                weights_arr = get_weights("EMOTION_AREAS_INFO.json", self.face_area, self.action)
             for markerID, marker_name in enumerate(self.labels):
                 self.weights[marker_name] = weights_arr[markerID]
 
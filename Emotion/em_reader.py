@@ -5,38 +5,88 @@ import pickle
 
 import numpy as np
 from numpy.linalg import norm
+from numpy.lib.stride_tricks import sliding_window_view
 import matplotlib.pyplot as plt
 
 from tools.basic import BasicMotion
 from tools.kalman import kalman_filter
+from tools.cache import load_gesture, dump_gesture
 
 # path to Emotion project data
 EMOTION_PATH = os.path.join(os.path.dirname(__file__), "_data")
 
 
+def find_winks(eyes_wink, wink_window, to_be_wink_threshold=0.05):
+    """
+     Finds eye winks: local minima of the eyes openness, which are deep enough
+     w.r.t. the max openness within a half of wink window on both sides.
+    :param eyes_wink: (#frames,) sum of up-down distances of both eyes
+    :param wink_window: max wink duration in frames
+    :param to_be_wink_threshold: min depth of a wink, relative to the max openness
+    :return: (#winks, 2) [start, end) frames of the winks
+    """
+    half = wink_window // 2
+    frames = len(eyes_wink)
+    padding = np.repeat(-np.inf, half)
+
+    # (#frames, half) windows eyes_wink[frame-half:frame] and eyes_wink[frame:frame+half]
+    left_windows = sliding_window_view(np.append(padding, eyes_wink), half)[:frames]
+    right_windows = sliding_window_view(np.append(eyes_wink, padding), half)[:frames]
+    deep_left = (np.max(left_windows, axis=1) - eyes_wink) / np.max(eyes_wink)
+    deep_right = (np.max(right_windows, axis=1) - eyes_wink) / np.max(eyes_wink)
+
+    local_min = np.zeros(frames, dtype=bool)
+    local_min[1:-1] = (eyes_wink[1:-1] < eyes_wink[:-2]) & (eyes_wink[1:-1] < eyes_wink[2:])
+    is_wink = local_min & (deep_left > to_be_wink_threshold) & (deep_right > to_be_wink_threshold)
+    wink_frames = np.where(is_wink)[0]
+
+    # winks span from the left max to the right max
+    starts = wink_frames - half + np.argmax(left_windows[wink_frames], axis=1)
+    ends = wink_frames + np.argmax(right_windows[wink_frames], axis=1)
+    return np.column_stack((starts, ends))
+
+
 class Emotion(BasicMotion):
-    def __init__(self, pkl_path, fps=None):
+    cached_fields = BasicMotion.cached_fields + ("author", "emotion", "slope")
+    cached_arrays = BasicMotion.cached_arrays + ("winks",)
+
+    def __init__(self, pkl_path, fps=None, lazy=False):
         """
         :param pkl_path: path to pickled data
         :param fps: new fps to be set
+        :param lazy: postpone reading the data till the first access to it
         """
         BasicMotion.__init__(self, fps=24)
         self.project = "Emotion"
+        self.winks = np.empty((0, 2), dtype=int)
         self.fname = os.path.basename(pkl_path).strip(".pkl")
 
-        # loading data from a pickle
-        info = pickle.load(open(pkl_path, 'rb'))
-        self.data = info["data"]
-        self.norm_data = None
-        self.author = info["author"]
-        self.emotion = info["emotion"]
-        self.labels = tuple(info["labels"])
-        self.frames = self.data.shape[1]
-        self.name = self.emotion
-        self.slope = 0
-
-        self.set_fps(fps)
-        self.preprocessor()
+        if lazy:
+            self.defer(self.load, pkl_path, fps)
+        else:
+            self.load(pkl_path, fps)
+
+    def load(self, pkl_path, fps):
+        """
+         Reads and preprocesses the data (or restores it from the cache).
+        :param pkl_path: path to pickled data
+        :param fps: new fps to be set
+        """
+        if not load_gesture(self, pkl_path, fps):
+            # loading data from a pickle
+            info = pickle.load(open(pkl_path, 'rb'))
+            self.data = info["data"]
+            self.norm_data = None
+            self.author = info["author"]
+            self.emotion = info["emotion"]
+            self.labels = tuple(info["labels"])
+            self.frames = self.data.shape[1]
+            self.name = self.emotion
+            self.slope = 0
+
+            self.set_fps(fps)
+            self.preprocessor()
+            dump_gesture(self, pkl_path, fps)
         self.set_weights()
 
     def __str__(self):
@@ -77,7 +127,7 @@ class Emotion(BasicMotion):
         self.norm_data = kalman_filter(self.norm_data)
 
         # step 5: deal with eyes winking
-        self.deal_with_winking()
+        self.winks = self.deal_with_winking()
 
     def define_moving_markers(self, mode):
         """
@@ -115,40 +165,25 @@ class Emotion(BasicMotion):
          It's known, that a human wink duration lies within the range of [300, 600] ms.
          Taking that into account, we can find out winking frames,
          skip them and approximate the gap instead.
-         Uncomment plotting stuff to see the approximation result.
+        :return: (#winks, 2) [start, end) frames of the approximated winks
         """
         wink_window = int(0.6 * self.fps)
 
         # make sure wink window is big enough
-        if wink_window < 2: return
-
-        to_be_wink_threshold = 0.05
-        eup_r, edn_r, eup_l, edn_l = self.get_ids("eup_r", "edn_r", "eup_l", "edn_l")
-        both_eyes = (eup_r, edn_r), (eup_l, edn_l)
-        up_down_dist = []
-        for eye in both_eyes:
-            eye_vector = self.norm_data[eye[0], ::] - self.norm_data[eye[1], ::]
-            up_down_dist.append(norm(eye_vector, axis=1))
-        eyes_wink = np.sum(up_down_dist, axis=0)
-
-        for frame in range(1, len(eyes_wink) - 1):
-            start = max(0, frame - wink_window // 2)
-            end = min(len(eyes_wink), frame + wink_window // 2)
-            left_bound = max(eyes_wink[start:frame])
-            right_bound = max(eyes_wink[frame:end])
-            if eyes_wink[frame] < eyes_wink[frame - 1] and eyes_wink[frame] < eyes_wink[frame + 1]:
-                deep_left = (left_bound - eyes_wink[frame]) / max(eyes_wink)
-                deep_right = (right_bound - eyes_wink[frame]) / max(eyes_wink)
-                if deep_left > to_be_wink_threshold and deep_right > to_be_wink_threshold:
-                    start = start + np.argmax(eyes_wink[start:frame])
-                    end = frame + np.argmax(eyes_wink[frame:end])
-                    for eye in both_eyes:
-                        for eye_marker in eye:
-                            for dim in range(self.norm_data.shape[2]):
-                                x_begin = self.norm_data[eye_marker, start, dim]
-                                x_end = self.norm_data[eye_marker, end, dim]
-                                line = np.linspace(x_begin, x_end, end - start)
-                                self.norm_data[eye_marker, start:end, dim] = line
+        if wink_window < 2:
+            return np.empty((0, 2), dtype=int)
+
+        eye_markers = self.get_ids("eup_r", "edn_r", "eup_l", "edn_l")
+        eye_vectors = self.norm_data[eye_markers[::2], ::] - self.norm_data[eye_markers[1::2], ::]
+        eyes_wink = np.sum(norm(eye_vectors, axis=2), axis=0)
+        winks = find_winks(eyes_wink, wink_window)
+
+        # winks may overlap, so they are approximated one by one
+        for start, end in winks:
+            x_begin = self.norm_data[eye_markers, start, :]
+            x_end = self.norm_data[eye_markers, end, :]
+            self.norm_data[eye_markers, start:end, :] = np.linspace(x_begin, x_end, end - start, axis=1)
+        return winks
 
     def gaussian_filter(self):
         """
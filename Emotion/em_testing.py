@@ -20,8 +20,10 @@ def run_the_worst_comparison(mode=None, beta=None, fps=None, weighted=True):
                      unweighted scenario doesn't require computing the weights,
                       cause all weights are set to be 1.
     """
-    Training(Emotion).compute_weights(mode, beta, fps)
-    Testing(Emotion).the_worst_comparison(fps, weighted=weighted)
+    training = Training(Emotion)
+    trn_set = training.load_train_set(fps)
+    training.compute_weights(mode, beta, fps, trn_set)
+    Testing(Emotion).the_worst_comparison(fps, weighted=weighted, trn_set=trn_set)
 
 
 def print_average_duration():
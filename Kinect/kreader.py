@@ -16,6 +16,7 @@ import os
 import numpy as np
 
 from tools.humanoid import HumanoidBasic
+from tools.cache import load_gesture, dump_gesture
 from tools.anim_viewer import DataViewer
 from Kinect.data_manager import load_database
 
@@ -26,6 +27,9 @@ KINECT_PATH = load_database()
 # total number of present markers
 MARKERS = 20
 
+# number of lines per frame: frame id, time and 4 lines per marker
+BLOCK_SIZE = 2 + 4 * MARKERS
+
 
 def convert_time(string):
     """
@@ -53,11 +57,45 @@ def gather_labels(rlines):
 
 def read_body(rlines):
     """
+     Picks the frame ids, time and coords lines of all frames
+     by their indices and converts each kind in one go.
+    :param rlines: body lines from txt-file
+    :returns: - (20, frames, 3) data
+              - fps
+    """
+    frames = int(rlines[4])
+    data = np.zeros(shape=(MARKERS, frames, 3))
+    chunks = int((len(rlines) / BLOCK_SIZE))
+
+    if frames != chunks:
+        warnings.warn("frames != chunks; took min")
+        frames = min(frames, chunks)
+
+    block_begins = 5 + BLOCK_SIZE * np.arange(frames)
+    frame_ids = np.array([rlines[begin][1:] for begin in block_begins], dtype=int)
+    time_events = np.array([rlines[begin + 1].split(":") for begin in block_begins], dtype=float)
+    time_events = time_events.reshape(frames, 3).dot([3600., 60., 1.])
+
+    # (frames, markers, 3) ids of x, z, y lines
+    coord_ids = block_begins[:, np.newaxis, np.newaxis] + 3 + 4 * np.arange(MARKERS)[:, np.newaxis] + np.arange(3)
+    coords = np.array([rlines[ind] for ind in coord_ids.ravel()], dtype=float)
+    x, z, y = np.rollaxis(coords.reshape(coord_ids.shape), 2)
+    data[:, frame_ids, :] = np.dstack((x.T, -y.T, z.T))
+
+    dt = time_events[1:] - time_events[:-1]
+    fps = np.average(1. / dt)
+
+    return data, fps
+
+
+def _read_body_by_frames(rlines):
+    """
+     Frame by frame version of read_body (kept for benchmarks).
     :param rlines: body lines from txt-file
     :returns: - (20, frames, 3) data
               - fps
     """
-    block_size = 82
+    block_size = BLOCK_SIZE
     frames = int(rlines[4])
     data = np.zeros(shape=(MARKERS, frames, 3))
     chunks = int((len(rlines) / block_size))
@@ -91,11 +129,12 @@ class HumanoidKinect(HumanoidBasic):
             http://datascience.sehir.edu.tr/visapp2013/
     """
 
-    def __init__(self, txt_path, fps=None):
+    def __init__(self, txt_path, fps=None, lazy=False):
         """
          Creates a gesture from a Kinect folder.
         :param txt_path: txt-file path
         :param fps: new fps to be set
+        :param lazy: postpone reading the data till the first access to it
         """
         HumanoidBasic.__init__(self, fps)
         self.project = "Kinect"
@@ -115,15 +154,28 @@ class HumanoidKinect(HumanoidBasic):
         self.prime_hand = txt_path.split(os.sep)[-1].split("Hand")[0].lower()
         self.free_hand = swap[self.prime_hand]
 
-        with open(txt_path, 'rU') as rfile:
-            rlines = rfile.readlines()
-            self.name = rlines[3][1:-1]
-            self.labels = gather_labels(rlines)
-            self.data, self.fps = read_body(rlines)
+        if lazy:
+            self.defer(self.load, txt_path, fps)
+        else:
+            self.load(txt_path, fps)
 
-        self.frames = self.data.shape[1]
-        self.set_fps(fps)
-        self.preprocessing()
+    def load(self, txt_path, fps):
+        """
+         Reads and preprocesses the data (or restores it from the cache).
+        :param txt_path: txt-file path
+        :param fps: new fps to be set
+        """
+        if not load_gesture(self, txt_path, fps):
+            with open(txt_path, 'rU') as rfile:
+                rlines = rfile.readlines()
+                self.name = rlines[3][1:-1]
+                self.labels = gather_labels(rlines)
+                self.data, self.fps = read_body(rlines)
+
+            self.frames = self.data.shape[1]
+            self.set_fps(fps)
+            self.preprocessing()
+            dump_gesture(self, txt_path, fps)
         self.set_weights()
 
     def define_moving_markers(self, mode):
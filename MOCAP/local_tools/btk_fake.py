@@ -17,6 +17,8 @@
 import c3d
 import numpy as np
 
+from MOCAP.local_tools.c3d_points import read_points
+
 
 def gather_labels(reader):
     """
@@ -34,12 +36,21 @@ def gather_labels(reader):
     return tuple(labels)
 
 
+def count_frames(reader):
+    """
+    :param reader: c3d Reader object
+    :return: number of frames
+    """
+    return reader.header.last_frame - reader.header.first_frame + 1
+
+
 def gather_data(reader):
     """
+     Frame by frame version of read_points (kept for benchmarks).
     :param reader: c3d Reader object
     :return np.array: (#markers, #frames, 3) data
     """
-    frames = reader.last_frame() - reader.first_frame() + 1
+    frames = count_frames(reader)
     markers = reader.header.point_count
     data = np.empty(shape=(markers, frames, 3))
     for i, (_, points, _) in enumerate(reader.read_frames()):
@@ -83,9 +94,9 @@ class Acquisition(object):
         with open(fname, 'rb') as handle:
             reader = c3d.Reader(handle)
             self.fps = reader.header.frame_rate
-            self.frames = reader.last_frame() - reader.first_frame() + 1
+            self.frames = count_frames(reader)
             self.labels = gather_labels(reader)
-            self.data = gather_data(reader)
+            self.data = read_points(reader, fname)
             assert self.frames == self.data.shape[1], "#frames don't match with data.shape"
 
     def GetData(self):
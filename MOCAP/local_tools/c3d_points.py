@@ -0,0 +1,121 @@
+# coding=utf-8
+
+"""
+ Fast reader of c3d POINT data.
+ Unlike c3d.Reader.read_frames, which decodes the file frame by frame,
+ it maps the whole data section onto an array and picks the coords
+ of the requested markers at once.
+ The header and parameters are still parsed with the c3d module.
+"""
+
+import warnings
+
+import numpy as np
+
+# processor type (the 4th byte of the parameter section) --> byte order
+_INTEL, _DEC, _MIPS = 84, 85, 86
+_BYTE_ORDER = {_INTEL: '<', _DEC: '<', _MIPS: '>'}
+
+
+def _processor_type(c3d_path, parameter_block):
+    """
+    :param c3d_path: path to .c3d-file
+    :param parameter_block: 1-based number of the first parameter block
+    :return: processor type (84 - Intel, 85 - DEC, 86 - MIPS)
+    """
+    with open(c3d_path, 'rb') as handle:
+        handle.seek((parameter_block - 1) * 512 + 3)
+        return ord(handle.read(1))
+
+
+def _dec_to_ieee(words):
+    """
+    :param words: (...) uint32 words of DEC floats, read as little-endian
+    :return: (...) float32 values
+    """
+    # DEC float is IEEE one with swapped 16-bit halves and 4 times bigger
+    swapped = (words << 16) | (words >> 16)
+    return swapped.view(np.float32) / np.float32(4.)
+
+
+def point_scale(reader):
+    """
+    :param reader: c3d Reader object
+    :return: POINT:SCALE (negative for float data)
+    """
+    param = reader.get("POINT:SCALE")
+    if param is None:
+        return reader.header.scale_factor
+    return param.float_value
+
+
+def read_points(reader, c3d_path, marker_ids=None, start=0, stop=None):
+    """
+    :param reader: c3d Reader object of the c3d_path
+    :param c3d_path: path to .c3d-file
+    :param marker_ids: ids of markers to be read; pass None to read all
+    :param start: first frame to be read
+    :param stop: frame to stop reading at (excluded); pass None to read till the end
+    :return: (#markers, #frames, 3) points data in metres
+    """
+    header = reader.header
+    frames = header.last_frame - header.first_frame + 1
+    if marker_ids is None:
+        marker_ids = np.arange(header.point_count)
+    marker_ids = np.asarray(marker_ids, dtype=int)
+
+    scale = point_scale(reader)
+    is_float = scale < 0
+    proc_type = _processor_type(c3d_path, header.parameter_block)
+    byte_order = _BYTE_ORDER.get(proc_type, '<')
+    if is_float:
+        word = byte_order + ('u4' if proc_type == _DEC else 'f4')
+    else:
+        word = byte_order + 'i2'
+    word = np.dtype(word)
+
+    # each frame holds (x, y, z, residual) words per marker and then analog samples
+    frame_words = 4 * header.point_count + header.analog_count
+    offset = (header.data_block - 1) * 512
+    raw = np.memmap(c3d_path, dtype=np.uint8, mode='r', offset=offset)
+    frames_found = len(raw) // (frame_words * word.itemsize)
+    if frames_found < frames:
+        warnings.warn("%s: found %d frames out of %d" % (c3d_path, frames_found, frames))
+        frames = frames_found
+    raw = raw[:frames * frame_words * word.itemsize].view(word).reshape(frames, frame_words)
+    # only the pages of the requested frames are read from the disk
+    raw = raw[start:stop]
+
+    # (#frames, #markers, 3) coords of the chosen markers only
+    coords = raw[:, 4 * marker_ids[:, np.newaxis] + np.arange(3)]
+    del raw
+    if is_float:
+        if proc_type == _DEC:
+            coords = _dec_to_ieee(coords)
+        else:
+            coords = coords.astype(np.float32)
+    else:
+        coords = (coords * abs(scale)).astype(np.float32)
+    # non-finite coords are passed through, as gather_data does
+
+    # dealing with mm --> m
+    return np.swapaxes(coords, 0, 1).astype(float) / 1e3
+
+
+def iter_points(reader, c3d_path, chunk_size=120, marker_ids=None):
+    """
+     Reads the points data chunk by chunk, so a long capture session
+     isn't held in memory at once.
+    :param reader: c3d Reader object of the c3d_path
+    :param c3d_path: path to .c3d-file
+    :param chunk_size: number of frames per chunk
+    :param marker_ids: ids of markers to be read; pass None to read all
+    :return: generator of (#markers, #chunk frames, 3) points data in metres
+    """
+    frames = reader.header.last_frame - reader.header.first_frame + 1
+    for start in range(0, frames, chunk_size):
+        chunk = read_points(reader, c3d_path, marker_ids, start, start + chunk_size)
+        if chunk.shape[1] == 0:
+            # the file is shorter than the header says
+            break
+        yield chunk
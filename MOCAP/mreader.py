@@ -5,6 +5,7 @@ import numpy as np
 import c3d
 
 from tools.humanoid import HumanoidBasic
+from tools.cache import load_gesture, dump_gesture
 import MOCAP.local_tools.labelling as labelling
 from tools.anim_viewer import MocapViewer
 
@@ -30,11 +31,11 @@ def gather_points_data(acq):
         return acq.GetData()
     else:
         # returning data read with native btk module
-        data = np.empty((3, acq.GetPointFrameNumber(), 1))
+        data = []
         for i in range(0, acq.GetPoints().GetItemNumber()):
             label_id = acq.GetPoint(i).GetLabel()
-            data = np.dstack((data, acq.GetPoint(label_id).GetValues().T))
-        data = np.delete(data.T, 0, axis=0)  # first marker is noisy
+            data.append(acq.GetPoint(label_id).GetValues())
+        data = np.array(data, dtype=float).reshape(-1, acq.GetPointFrameNumber(), 3)
 
         # dealing with mm --> m
         return data / 1e3
@@ -56,11 +57,14 @@ class HumanoidUkr(HumanoidBasic):
     """
      Creates an instance of Ukrainian Motion Capture gesture, saved in .c3d-format.
     """
-    def __init__(self, c3d_path, fps=None):
+    loaded_fields = HumanoidBasic.loaded_fields + ("hand_markers",)
+
+    def __init__(self, c3d_path, fps=None, lazy=False):
         """
          Reads Motion Capture C3D file.
         :param c3d_path: path to file.c3d
         :param fps: new fps to be set
+        :param lazy: postpone reading the data till the first access to it
         """
         HumanoidBasic.__init__(self, fps)
         self.project = "MoCap"
@@ -70,25 +74,40 @@ class HumanoidUkr(HumanoidBasic):
         self.fpath = c3d_path
         self.fname = os.path.basename(c3d_path)
 
-        # setting up BTK reader to gather acquisition
-        reader = btk.btkAcquisitionFileReader()
-        reader.SetFilename(c3d_path)
-        reader.Update()
-        acq = reader.GetOutput()
+        self.shoulder_markers = "LBSH", "CLAV", "RBSH"
 
-        # default fps (should be 120)
-        self.fps = acq.GetPointFrequency()
+        if lazy:
+            self.defer(self.load, c3d_path, fps)
+        else:
+            self.load(c3d_path, fps)
 
-        # dealing with markers
-        self.labels = labelling.gather_labels(acq)
-        self.hand_markers = labelling.get_hand_labels(self.labels)
-        self.shoulder_markers = "LBSH", "CLAV", "RBSH"
+    def load(self, c3d_path, fps):
+        """
+         Reads and preprocesses the data (or restores it from the cache).
+        :param c3d_path: path to file.c3d
+        :param fps: new fps to be set
+        """
+        if not load_gesture(self, c3d_path, fps):
+            # setting up BTK reader to gather acquisition
+            reader = btk.btkAcquisitionFileReader()
+            reader.SetFilename(c3d_path)
+            reader.Update()
+            acq = reader.GetOutput()
+
+            # default fps (should be 120)
+            self.fps = acq.GetPointFrequency()
+
+            # dealing with markers
+            self.labels = labelling.gather_labels(acq)
+
+            # dealing with data
+            self.data = gather_points_data(acq)
+            self.frames = self.data.shape[1]
+            self.set_fps(fps)
+            self.preprocessing()
+            dump_gesture(self, c3d_path, fps)
 
-        # dealing with data
-        self.data = gather_points_data(acq)
-        self.frames = self.data.shape[1]
-        self.set_fps(fps)
-        self.preprocessing()
+        self.hand_markers = labelling.get_hand_labels(self.labels)
         self.set_weights()
 
     def __str__(self):
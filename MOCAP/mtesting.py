@@ -28,8 +28,10 @@ def run_the_worst_comparison(mode="bothHands", beta=None, fps=None, weighted=Tru
                      unweighted scenario doesn't require computing the weights,
                       cause all weights are set to be 1.
     """
-    Training(HumanoidUkr).compute_weights(mode, beta, fps)
-    Testing(HumanoidUkr).the_worst_comparison(fps, weighted=weighted)
+    training = Training(HumanoidUkr)
+    trn_set = training.load_train_set(fps)
+    training.compute_weights(mode, beta, fps, trn_set)
+    Testing(HumanoidUkr).the_worst_comparison(fps, weighted=weighted, trn_set=trn_set)
 
 
 def print_average_duration():
@@ -1,12 +1,20 @@
 # coding=utf-8
 
 import os
+import warnings
+from collections import deque
 
+import c3d
 import numpy as np
+from numpy.linalg import norm
 import matplotlib.pyplot as plt
 
 from MOCAP.mreader import HumanoidUkr
 from MOCAP.prepare_c3d.helper import get_corrupted_frames, init_frame
+from MOCAP.local_tools.btk_fake import gather_labels
+from MOCAP.local_tools.c3d_points import iter_points
+from MOCAP.local_tools.labelling import get_hand_labels
+from tools.humanoid import HumanoidNormStream
 
 
 class HumanoidUkrSplitter(HumanoidUkr):
@@ -19,7 +27,8 @@ class HumanoidUkrSplitter(HumanoidUkr):
 
     def compute_offset(self, mode="bothHands", step=1):
         """
-         Computes and stores offset (deviation) from current to init pos for each frame.
+         Computes and stores offset (deviation) from current to init pos for each frame
+         (see RelaxedPoseSegmenter for the streaming version without init_frame).
         :param mode: whether use only hands marker or full set of markers
         :param step: number of frames per step
         """
@@ -89,10 +98,7 @@ class HumanoidUkrSplitter(HumanoidUkr):
                 (for each sample per gest)
         """
         self.compute_relaxed_indices(split_thr)
-        pairs = zip(self.relaxed_indices[:-1], self.relaxed_indices[1:])
-        double_pairs = [(pairs[i], pairs[i + 1]) for i in range(0, len(self.relaxed_indices) - 1, 2)]
-
-        return double_pairs
+        return double_border_frames(self.relaxed_indices)
 
 
     def plot_relaxed_indices(self):
@@ -115,6 +121,246 @@ class HumanoidUkrSplitter(HumanoidUkr):
         plt.show()
 
 
+class RelaxedPoseSegmenter(object):
+    """
+     Streaming replacement of compute_offset and compute_relaxed_indices.
+     The relaxed pose isn't taken from init_frame tables: it's the running median
+     of the poses, which the hands have been still in for a while. The performer
+     returns to the relaxed pose after each gesture, so it's the most frequent
+     still pose, whereas short holds within gestures don't move the median.
+     The frames are classified window by window, each window with the relaxed pose
+     estimated by the windows up to it, so the border frames don't depend
+     on how the stream is chunked. A border frame is emitted in the middle
+     of each relaxed interval, but not later than max_latency frames
+     after the interval has started.
+     The frames are expected to be normalized by HumanoidNormStream,
+     so the thresholds are measured in shoulder widths.
+    """
+
+    def __init__(self, fps, offset_thr=0.25, motion_thr=0.3, still_time=0.25, history=64, max_latency=None):
+        """
+        :param fps: frames per second
+        :param offset_thr: the frames, which average marker offset from the relaxed pose
+                           is below that value, are considered to be relaxed
+        :param motion_thr: the windows, which average marker speed (per second) is below
+                           that value, are considered to be still
+        :param still_time: duration of still windows (sec); it's the min relaxed interval as well
+        :param history: number of the last still windows the relaxed pose is estimated by
+        :param max_latency: the border frame of a relaxed interval is emitted not later than
+                            max_latency frames (plus a window) after the interval start;
+                            it's also the max number of frames to wait for the first
+                            relaxed pose estimate; pass None to use 4 still windows
+        """
+        self.fps = fps
+        self.offset_thr = offset_thr
+        self.motion_thr = motion_thr
+        self.window = max(2, int(round(still_time * fps)))
+        self.max_latency = 4 * self.window if max_latency is None else max_latency
+        self.still_poses = deque(maxlen=history)
+        self.relaxed_pose = None
+        # number of classified frames
+        self.frames = 0
+        # frames of the incomplete window
+        self.tail = None
+        # windows, which came before the first relaxed pose estimate
+        self.waiting = deque()
+        # start of the current relaxed interval and whether its border frame is emitted
+        self.relaxed_start = None
+        self.emitted = False
+
+    def _add_window(self, window_frames):
+        """
+         Adds the window pose to the history, if the window is still.
+         The window speed is taken by the shift of its halves average poses,
+         so it isn't affected by the markers jitter.
+        :param window_frames: (#markers, window, 3) normalized frames
+        """
+        half = self.window // 2
+        shift = np.nanmean(window_frames[:, -half:], axis=1) - np.nanmean(window_frames[:, :half], axis=1)
+        speed = np.nanmean(norm(shift, axis=1)) * self.fps / float(self.window - half)
+        if speed < self.motion_thr:
+            self.still_poses.append(np.nanmean(window_frames, axis=1))
+            self.relaxed_pose = np.nanmedian(self.still_poses, axis=0)
+
+    def _classify(self, frames):
+        """
+        :param frames: (#markers, #frames, 3) normalized frames to be classified
+                       with the current relaxed pose
+        :return: list of border frames ids, found by now
+        """
+        offset = np.nanmean(norm(frames - self.relaxed_pose[:, np.newaxis], axis=2), axis=0)
+        return self._track(offset < self.offset_thr)
+
+    def _track(self, is_relaxed):
+        """
+         Tracks relaxed intervals of the next classified frames.
+        :param is_relaxed: (#frames,) whether the frames are relaxed
+        :return: list of border frames ids, found by now
+        """
+        if len(is_relaxed) == 0:
+            return []
+        first_id = self.frames
+        self.frames += len(is_relaxed)
+
+        # relaxed intervals within the frames: [starts[k], ends[k])
+        edges = np.diff(np.concatenate(([self.relaxed_start is not None], is_relaxed, [False])).astype(int))
+        starts = first_id + np.where(edges == 1)[0]
+        ends = first_id + np.where(edges == -1)[0]
+        if self.relaxed_start is not None:
+            starts = np.concatenate(([self.relaxed_start], starts))
+
+        borders = []
+        for start, end in zip(starts, ends):
+            is_open = end == self.frames and is_relaxed[-1]
+            if start != self.relaxed_start:
+                self.emitted = False
+            self.relaxed_start = start if is_open else None
+            if self.emitted:
+                continue
+            if end - start >= self.max_latency:
+                borders.append(int(start + self.max_latency // 2))
+                self.emitted = True
+            elif not is_open and end - start >= self.window:
+                borders.append(int(start + (end - start - 1) // 2))
+        return borders
+
+    def update(self, chunk):
+        """
+        :param chunk: (#markers, #frames, 3) next normalized frames
+        :return: list of border frames ids, found by now
+        """
+        chunk = np.asarray(chunk, dtype=float)
+        frames = chunk if self.tail is None else np.concatenate((self.tail, chunk), axis=1)
+        windows = frames.shape[1] // self.window
+        self.tail = frames[:, windows * self.window:]
+        borders = []
+        with warnings.catch_warnings():
+            # all NaN markers and frames are fine here
+            warnings.simplefilter("ignore", RuntimeWarning)
+            for window_id in range(windows):
+                window_frames = frames[:, window_id * self.window:(window_id + 1) * self.window]
+                self._add_window(window_frames)
+                if self.relaxed_pose is None:
+                    self.waiting.append(window_frames)
+                    if len(self.waiting) * self.window > self.max_latency:
+                        # too old to wait for the relaxed pose
+                        borders += self._track(np.zeros(self.waiting.popleft().shape[1], dtype=bool))
+                    continue
+                while self.waiting:
+                    borders += self._classify(self.waiting.popleft())
+                borders += self._classify(window_frames)
+        return borders
+
+    def flush(self):
+        """
+         Finishes the stream.
+        :return: list of the last border frames (if any)
+        """
+        borders = []
+        if self.relaxed_pose is not None:
+            with warnings.catch_warnings():
+                warnings.simplefilter("ignore", RuntimeWarning)
+                while self.waiting:
+                    borders += self._classify(self.waiting.popleft())
+                if self.tail is not None:
+                    borders += self._classify(self.tail)
+        self.waiting.clear()
+        self.tail = None
+        if self.relaxed_start is not None and not self.emitted and \
+                self.frames - self.relaxed_start >= self.window:
+            borders.append(int(self.relaxed_start + (self.frames - self.relaxed_start - 1) // 2))
+        self.relaxed_start = None
+        return borders
+
+
+def double_border_frames(border_frames):
+    """
+    :param border_frames: relaxed frames ids, which split the gestures
+    :return list of double pairs, each of them contains 2 pairs of border frames
+            (for each sample per gest)
+    """
+    pairs = list(zip(border_frames[:-1], border_frames[1:]))
+    return [(pairs[i], pairs[i + 1]) for i in range(0, len(pairs) - 1, 2)]
+
+
+def iter_c3d_chunks(c3d_path, mode="bothHands", chunk_size=120):
+    """
+     Reads and normalizes .c3d-file chunk by chunk.
+    :param c3d_path: path to .c3d-file
+    :param mode: whether use only hands marker or full set of markers
+    :param chunk_size: number of frames per chunk
+    :return: fps, markers names and generator of (#markers, #chunk frames, 3) normalized frames
+    """
+    # the header and parameters are parsed at once, and the points
+    # are read by the path (see read_points), so the file isn't kept open
+    with open(c3d_path, 'rb') as handle:
+        reader = c3d.Reader(handle)
+    labels = gather_labels(reader)
+    shoulder_markers = "LBSH", "CLAV", "RBSH"
+    if mode == "bothHands":
+        chosen = list(get_hand_labels(labels))
+        chosen += [marker for marker in shoulder_markers if marker not in chosen]
+    else:
+        chosen = list(labels)
+    marker_ids = [labels.index(marker) for marker in chosen]
+    norm_stream = HumanoidNormStream(chosen, shoulder_markers)
+
+    def chunks():
+        for chunk in iter_points(reader, c3d_path, chunk_size, marker_ids):
+            # missed markers are stored as zeros
+            chunk[(chunk == 0).all(axis=2)] = np.nan
+            yield norm_stream.update(chunk)
+
+    return reader.header.frame_rate, tuple(chosen), chunks()
+
+
+def stream_border_frames(c3d_path, mode="bothHands", chunk_size=120, **segmenter_params):
+    """
+     Finds relaxed border frames of .c3d-file, not holding the whole file in memory.
+    :param c3d_path: path to .c3d-file
+    :param mode: whether use only hands marker or full set of markers
+    :param chunk_size: number of frames per chunk
+    :param segmenter_params: RelaxedPoseSegmenter params
+    :return: list of border frames ids
+    """
+    fps, _, chunks = iter_c3d_chunks(c3d_path, mode, chunk_size)
+    segmenter = RelaxedPoseSegmenter(fps, **segmenter_params)
+    border_frames = []
+    for chunk in chunks:
+        border_frames.extend(segmenter.update(chunk))
+    return border_frames + segmenter.flush()
+
+
+def iter_gestures(chunks, segmenter, max_frames):
+    """
+     Cuts the stream into gestures between border frames (e.g. to be recognized).
+     Only the frames since the last border frame are kept.
+    :param chunks: iterable of (#markers, #frames, 3) normalized frames
+    :param segmenter: RelaxedPoseSegmenter instance
+    :param max_frames: longer gestures are skipped
+    :return: generator of (first frame id, last frame id, (#markers, #frames, 3) gesture data)
+    """
+    kept = None
+    kept_start = 0
+    last_border = None
+    for chunk in chunks:
+        kept = chunk if kept is None else np.concatenate((kept, chunk), axis=1)
+        for border in segmenter.update(chunk):
+            if last_border is not None and last_border >= kept_start:
+                yield last_border, border, kept[:, last_border - kept_start:border - kept_start + 1]
+            last_border = border
+            if border >= kept_start:
+                kept = kept[:, border - kept_start:]
+                kept_start = border
+        if kept.shape[1] > max_frames:
+            # too long to be a gesture
+            kept_start += kept.shape[1] - max_frames
+            kept = kept[:, -max_frames:]
+    for border in segmenter.flush():
+        if last_border is not None and last_border >= kept_start:
+            yield last_border, border, kept[:, last_border - kept_start:border - kept_start + 1]
+
+
 def plot_them_all(folder):
     """
      Plots relaxed indices with their deviation from relaxed frame.
@@ -147,14 +147,16 @@ def split_file(folder_path, filename, double_pairs):
     print("%s was successfully split into 2x%d samples" % (short_name, len(double_pairs)))
 
 
-def split_mult_files(folder_path, split_thr):
+def split_mult_files(folder_path, split_thr=0.25):
     """
      Splits all examples into their folders by unique ones.
+     The files are read chunk by chunk (see RelaxedPoseSegmenter),
+     so long capture sessions aren't held in memory.
     :param folder_path: folder with .c3d-examples from particular group
-    :param split_thr: the positions below that value are considered to be near relaxed (init) pos
+    :param split_thr: the positions below that value (in shoulder widths)
+                      are considered to be near relaxed pos
     """
     for c3d_file in os.listdir(folder_path):
         if c3d_file.endswith(".c3d"):
-            gest = HumanoidUkrSplitter(folder_path + c3d_file)
-            double_pair = gest.get_double_border_frames(split_thr)
-            split_file(folder_path, c3d_file, double_pair)
\ No newline at end of file
+            border_frames = stream_border_frames(folder_path + c3d_file, offset_thr=split_thr)
+            split_file(folder_path, c3d_file, double_border_frames(border_frames))
\ No newline at end of file
@@ -0,0 +1,177 @@
+# coding=utf-8
+
+####################################################################
+# Columnar archive of a whole gesture corpus (Training + Testing). #
+# All the normalized coords lie in a single float32 blob,          #
+# which is memory mapped on reading, and gestures are served       #
+# as zero-copy GestureRecord views over it.                        #
+####################################################################
+
+import os
+import json
+import hashlib
+
+import numpy as np
+
+from tools.project_info import info_path, load_json
+from tools.record import GestureRecord
+
+SPLITS = "Training", "Testing"
+
+COORDS_NAME = "coords.npy"
+INDEX_NAME = "index.json"
+
+
+def weights_stamp(info_json):
+    """
+    :param info_json: path to PROJECT_INFO.json
+    :return: fingerprint of its "weights" section (None, if there is no file)
+    """
+    proj_info = load_json(info_json)
+    if proj_info is None:
+        return None
+    weights = json.dumps(proj_info.get("weights"), sort_keys=True)
+    return hashlib.sha1(weights.encode("utf-8")).hexdigest()
+
+
+def build_archive(MotionClass, proj_path, archive_path, fps=None, info_json=None):
+    """
+     Converts Training and Testing trees of a project into an archive.
+     The archive keeps the weights gestures have at the build time,
+     so it's to be rebuilt after the weights are changed
+     (GestureArchive checks it by the weights stamp of info_json).
+     The archive files are replaced only when both of them are written.
+    :param MotionClass: gesture class (HumanoidKinect, HumanoidUkr, Emotion, etc.)
+    :param proj_path: folder with Training and Testing data
+    :param archive_path: folder to save the archive into
+    :param fps: frames per second to be set;
+                pass as None to use the default fps
+    :param info_json: path to the json file the gestures take their weights from;
+                      pass None to use PROJECT_INFO.json of the gestures project
+    :return: number of archived gestures
+    """
+    # avoids circular import: instruments use archives
+    from tools.instruments import GestureDataset
+
+    index = {
+        "fps": fps,
+        "dim": None,
+        "split": [],
+        "class": [],
+        "name": [],
+        "author": [],
+        "fname": [],
+        "offset": [],
+        "markers": [],
+        "frames": [],
+        "labels": [],
+        "weights": [],
+        "gest_fps": [],
+    }
+    blocks = []
+    rows_total = 0
+    project = None
+    for split in SPLITS:
+        dataset = GestureDataset(MotionClass, os.path.join(proj_path, split), fps)
+        for gest, class_id in zip(dataset.gestures, dataset.class_ids):
+            markers, frames, dim = gest.norm_data.shape
+            assert index["dim"] in (None, dim), "gestures should have the same #dim"
+            index["dim"] = dim
+            index["split"].append(split)
+            index["class"].append(dataset.class_names[class_id])
+            # names like EmotionArea MultipleActions aren't json serializable
+            index["name"].append(str(gest.name))
+            index["author"].append(getattr(gest, "author", ""))
+            index["fname"].append(gest.fname)
+            index["offset"].append(rows_total)
+            index["markers"].append(markers)
+            index["frames"].append(frames)
+            index["labels"].append(list(gest.labels))
+            index["weights"].append(gest.get_weights().tolist())
+            index["gest_fps"].append(float(gest.fps))
+            blocks.append(gest.norm_data.reshape(markers * frames, dim))
+            rows_total += markers * frames
+            project = gest.project
+
+    if info_json is None and project is not None:
+        info_json = info_path(project)
+    if info_json is not None:
+        index["weights_stamp"] = {"path": os.path.abspath(info_json), "key": weights_stamp(info_json)}
+
+    if not os.path.exists(archive_path):
+        os.makedirs(archive_path)
+    coords_path = os.path.join(archive_path, COORDS_NAME)
+    index_path = os.path.join(archive_path, INDEX_NAME)
+    # the temporary coords path keeps the .npy extension for open_memmap
+    tmp_coords_path = "%s.%d.tmp.npy" % (coords_path[:-len(".npy")], os.getpid())
+    tmp_index_path = "%s.%d.tmp" % (index_path, os.getpid())
+    try:
+        coords = np.lib.format.open_memmap(tmp_coords_path, mode='w+', dtype=np.float32,
+                                           shape=(rows_total, index["dim"] or 0))
+        for offset, block in zip(index["offset"], blocks):
+            coords[offset:offset + len(block)] = block
+        coords.flush()
+        del coords
+        with open(tmp_index_path, 'w') as index_file:
+            json.dump(index, index_file)
+        for tmp_path, path in ((tmp_coords_path, coords_path), (tmp_index_path, index_path)):
+            if os.path.exists(path):
+                os.remove(path)
+            os.rename(tmp_path, path)
+    finally:
+        for tmp_path in (tmp_coords_path, tmp_index_path):
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+    return len(blocks)
+
+
+class GestureArchive(object):
+    """
+     Reads an archive made by build_archive.
+    """
+
+    def __init__(self, archive_path):
+        """
+        :param archive_path: archive folder
+        """
+        self.path = archive_path
+        with open(os.path.join(archive_path, INDEX_NAME), 'r') as index_file:
+            self.index = json.load(index_file)
+        stamp = self.index.get("weights_stamp")
+        if stamp is not None and os.path.exists(stamp["path"]):
+            if weights_stamp(stamp["path"]) != stamp["key"]:
+                raise ValueError("weights in %s have been changed since %s was built; rebuild the archive"
+                                 % (stamp["path"], archive_path))
+        self.fps = self.index["fps"]
+        self.coords = np.load(os.path.join(archive_path, COORDS_NAME), mmap_mode='r')
+
+    def __len__(self):
+        return len(self.index["name"])
+
+    def norm_data(self, gest_id):
+        """
+        :param gest_id: gesture id in the archive
+        :return: (#markers, #frames, #dim) zero-copy view of the gesture coords
+        """
+        offset = self.index["offset"][gest_id]
+        markers, frames = self.index["markers"][gest_id], self.index["frames"][gest_id]
+        return self.coords[offset:offset + markers * frames].reshape(markers, frames, -1)
+
+    def record(self, gest_id):
+        """
+        :param gest_id: gesture id in the archive
+        :return: GestureRecord view of the gesture
+        """
+        return GestureRecord(self.index["name"][gest_id], self.index["labels"][gest_id],
+                             self.norm_data(gest_id), self.index["weights"][gest_id],
+                             self.index["gest_fps"][gest_id], self.index["fname"][gest_id])
+
+    def records(self, split, fps):
+        """
+        :param split: "Training" or "Testing"
+        :param fps: frames per second the caller expects
+        :return: GestureRecord views of the split gestures
+        """
+        assert fps == self.fps, "the archive is built with another fps"
+        return tuple(self.record(gest_id) for gest_id, gest_split in enumerate(self.index["split"])
+                     if gest_split == split)
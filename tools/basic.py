@@ -5,18 +5,47 @@ from numpy.linalg import norm
 import matplotlib.pyplot as plt
 import matplotlib.animation as animation
 from matplotlib import rc
-import json
-import os
-import sys
 import warnings
 
+from tools.cache import load_gesture_info
+from tools.project_info import info_path, get_weights
+
 
 font = {'family': 'Verdana',
         'weight': 'normal'}
 rc('font', **font)
 
 
+def weights_from_displacements(displacements, betas, moving_num):
+    """
+     Maps joints displacements into DTW weights for each beta.
+     A zero beta (or None) stands for the vanishing beta,
+     which makes weights proportional to displacements.
+     Weights are made constant, if there is no displacement at all.
+     ZeroDivisionError is raised for a gesture without moving markers.
+    :param displacements: (..., #markers) joints displacements
+    :param betas: (#betas,) beta values
+    :param moving_num: number of moving markers; (...) array or a scalar
+    :return: (..., #betas, #markers) weights
+    """
+    displacements = np.asarray(displacements, dtype=float)[..., np.newaxis, :]
+    betas = np.array([0. if beta is None else beta for beta in betas], dtype=float)[:, np.newaxis]
+    activity = np.where(betas == 0, displacements, 1. - np.exp(-betas * displacements))
+    denom = np.sum(activity, axis=-1)[..., np.newaxis]
+    moving_num = np.asarray(moving_num, dtype=float)[..., np.newaxis, np.newaxis]
+    if (moving_num == 0).any():
+        raise ZeroDivisionError("a gesture has no moving markers")
+    with np.errstate(invalid="ignore", divide="ignore"):
+        return np.where(denom == 0, 1. / moving_num, activity / denom)
+
+
 class BasicMotion(object):
+    # preprocessed state to be kept in the gestures cache (see tools.cache)
+    cached_fields = ("name", "labels", "fps", "frames", "std")
+    cached_arrays = ("data", "norm_data")
+    # state, which the reader sets after the cached one
+    loaded_fields = ("weights",)
+
     def __init__(self, fps):
         self.fps = fps
         self.project = ""
@@ -34,6 +63,37 @@ class BasicMotion(object):
         self.fig = None
         self.ax = None
         self.faster = 1
+        self._lazy = None
+
+    def __getattr__(self, attr):
+        """
+         Loads a lazy gesture on the first access to its pending fields.
+         It's called only if the attribute isn't found the usual way.
+        """
+        lazy = self.__dict__.get("_lazy")
+        if lazy is None or attr not in lazy[0]:
+            raise AttributeError(attr)
+        pending, defaults, load, args = lazy
+        self._lazy = None
+        self.__dict__.update(defaults)
+        load(*args)
+        return getattr(self, attr)
+
+    def defer(self, load, src_path, fps):
+        """
+         Postpones load(src_path, fps) till the first access to the fields it sets.
+         The preprocessed metadata (name, labels, frames, fps, etc.) is taken
+         from the gestures cache at once, if the gesture has been cached.
+        :param load: method, which reads and preprocesses the data (or restores it from the cache)
+        :param src_path: path to the gesture source file
+        :param fps: new fps to be set
+        """
+        if load_gesture_info(self, src_path, fps):
+            pending = self.cached_arrays + self.loaded_fields
+        else:
+            pending = self.cached_fields + self.cached_arrays + self.loaded_fields
+        defaults = {field: self.__dict__.pop(field) for field in pending if field in self.__dict__}
+        self._lazy = pending, defaults, load, (src_path, fps)
 
     def __str__(self):
         """
@@ -100,27 +160,26 @@ class BasicMotion(object):
         """
          Computes joints displacements.
         :param mode: use both hand (by default) or only prime one
+        :return: (#markers,) joints displacements and (#markers,) their stds, ordered as labels
         """
         self.define_moving_markers(mode)
-        for markerID in range(self.norm_data.shape[0]):
-            marker = self.labels[markerID]
-            if marker in self.moving_markers:
-                # its shape == (frames-1, dim)
-                frames_xyz_delta = np.diff(self.norm_data[markerID, ::], axis=0)
-                frames_xyz_delta = frames_xyz_delta[~np.isnan(frames_xyz_delta).any(axis=1)]
-                if frames_xyz_delta.shape[0] > 0:
-                    dist_per_frame = norm(frames_xyz_delta, axis=1)
-                else:
-                    # that marker won't be involved in WDTW comparison
-                    dist_per_frame = 0
-
-                activity = np.sum(dist_per_frame)
-                j_std = np.std(dist_per_frame)
-            else:
-                activity = 0
-                j_std = 0
-            self.joint_displace[marker] = activity
-            self.joint_std[marker] = j_std
+        moving = np.isin(self.labels, list(self.moving_markers))
+
+        # (#markers, #frames-1) per frame distances; NaN steps are skipped
+        frames_xyz_delta = np.diff(self.norm_data, axis=1)
+        visible = ~np.isnan(frames_xyz_delta).any(axis=2) & moving[:, np.newaxis]
+        frames_xyz_delta[~visible] = 0.
+        dist_per_frame = norm(frames_xyz_delta, axis=2)
+
+        # markers without visible steps won't be involved in WDTW comparison
+        steps = np.maximum(visible.sum(axis=1), 1)
+        displace = np.sum(dist_per_frame, axis=1)
+        deviation = np.where(visible, dist_per_frame - (displace / steps)[:, np.newaxis], 0.)
+        j_std = np.sqrt(np.sum(deviation ** 2, axis=1) / steps)
+
+        self.joint_displace = dict(zip(self.labels, displace))
+        self.joint_std = dict(zip(self.labels, j_std))
+        return displace, j_std
 
     def define_plot_style(self):
         """
@@ -191,44 +250,28 @@ class BasicMotion(object):
          Computes weights to be used in DTW.
         :param beta: param to be chosen during the training
         """
-        self.compute_displacement(mode)
-        if beta is None or beta == 0:
-            denom = np.sum(list(self.joint_displace.values()))
-            if denom == 0:
-                self.set_constant_weights(mode)
-            else:
-                for marker in self.labels:
-                    self.weights[marker] = self.joint_displace[marker] / denom
-        else:
-            displacements = np.array(list(self.joint_displace.values()))
-            denom = np.sum(1. - np.exp(-beta * displacements))
-            if denom == 0:
-                self.set_constant_weights(mode)
-            else:
-                for marker in self.labels:
-                    self.weights[marker] = (1. - np.exp(-beta * self.joint_displace[marker])) / denom
+        weights_arr = self.weights_sweep(mode, (beta,))[0]
+        self.weights = dict(zip(self.labels, weights_arr))
+
+    def weights_sweep(self, mode, betas):
+        """
+         Computes weights for many betas at once.
+        :param mode: defines moving markers
+        :param betas: beta values (see compute_weights)
+        :return: (#betas, #markers) weights, ordered as labels
+        """
+        displace, _ = self.compute_displacement(mode)
+        return weights_from_displacements(displace, betas, len(self.moving_markers))
 
     def set_weights(self):
         """
          Loads weights from _INFO.json
         """
-        active_dirname = os.path.dirname(sys.argv[0])
-        json_file = self.project.upper() + "_INFO.json"
-        json_file = os.path.join(active_dirname, json_file)
-        if not os.path.exists(json_file):
-            active_dirname = os.path.dirname(active_dirname)
-            json_file = os.path.join(active_dirname, json_file)
-        try:
-            dic_info = json.load(open(json_file, 'r'))
-        except IOError:
-            dic_info = {"weights": ()}
-
-        weights_aver_dic = dic_info["weights"]
-        if self.name in weights_aver_dic:
+        weights_arr = get_weights(info_path(self.project), self.name)
+        if weights_arr is not None:
             # if _INFO file provides weights for current gesture
-            weights_arr = weights_aver_dic[self.name]
-            for markerID, marker_name in enumerate(self.labels):
-                self.weights[marker_name] = weights_arr[markerID]
+            for marker_name, weight in zip(self.labels, weights_arr):
+                self.weights[marker_name] = weight
         else:
             # compute weights for unknown gesture
             self.compute_weights(None, None)
@@ -0,0 +1,280 @@
+# coding=utf-8
+
+###################################################################
+# Timing benchmarks of weighted DTW engines on synthetic gestures #
+# of Kinect and MoCap sizes, and of the gesture readers.          #
+###################################################################
+
+import os
+import time
+from functools import partial
+
+import numpy as np
+
+from tools.fastdtw import _dtw, _fastdtw, banded_dtw, fastdtw
+
+try:
+    import tracemalloc
+except ImportError:
+    # Python 2.7: peak memory is not reported
+    tracemalloc = None
+
+# (#markers, #frames) of a typical gesture per project
+SEQUENCE_SIZES = {
+    "Kinect": (20, 60),
+    "MoCap": (83, 360),
+}
+
+
+def random_gesture(markers, frames, seed=None):
+    """
+    :param markers: number of markers
+    :param frames: number of frames
+    :param seed: random seed
+    :return: (#markers, #frames, 3) random walk data
+    """
+    rng = np.random.RandomState(seed)
+    steps = rng.normal(scale=0.02, size=(markers, frames, 3))
+    return np.cumsum(steps, axis=1)
+
+
+def time_it(func, repeat, *args):
+    """
+    :param func: function to be timed
+    :param repeat: number of runs
+    :return: (best run duration in sec, last function output)
+    """
+    best = np.inf
+    output = None
+    for _ in range(repeat):
+        start = time.time()
+        output = func(*args)
+        best = min(best, time.time() - start)
+    return best, output
+
+
+def bench_dtw_engines(repeat=3):
+    """
+     Compares the legacy dict-based DTW against the banded array one.
+    :param repeat: number of runs per measurement (the best one is taken)
+    """
+    print("%-8s %-10s %12s %12s %9s" % ("project", "algorithm", "legacy, ms", "banded, ms", "speedup"))
+    for project, (markers, frames) in sorted(SEQUENCE_SIZES.items()):
+        known = random_gesture(markers, frames, seed=0)
+        unknown = random_gesture(markers, int(1.2 * frames), seed=1)
+        weights = np.random.RandomState(2).rand(markers)
+        weights /= weights.sum()
+        setups = (
+            ("fastdtw", partial(_fastdtw, radius=1, dtw_engine=_dtw), fastdtw),
+            ("full dtw", _dtw, banded_dtw),
+        )
+        for algorithm, legacy, banded in setups:
+            legacy_dur, (legacy_cost, legacy_path) = time_it(legacy, repeat, known, unknown, weights)
+            banded_dur, (banded_cost, banded_path) = time_it(banded, repeat, known, unknown, weights)
+            assert np.isclose(legacy_cost, banded_cost), "dtw costs differ"
+            assert legacy_path == banded_path, "dtw paths differ"
+            print("%-8s %-10s %12.1f %12.1f %8.1fx" % (project, algorithm, 1e3 * legacy_dur,
+                                                        1e3 * banded_dur, legacy_dur / banded_dur))
+
+
+def bench_fastdtw_levels(durations=(5, 10, 30, 60), fps=120, radius=1):
+    """
+     Reports FastDTW recursion depth, window size and peak memory
+     per comparison of MoCap-like captures.
+    :param durations: capture durations in sec
+    :param fps: frames per second
+    :param radius: FastDTW radius
+    """
+    markers = SEQUENCE_SIZES["MoCap"][0]
+    weights = np.ones(markers) / markers
+    print("%-9s %-7s %-6s %-14s %12s %10s" % ("duration", "frames", "depth",
+                                              "window cells", "peak, MB", "time, s"))
+    for duration in durations:
+        frames = int(duration * fps)
+        known = random_gesture(markers, frames, seed=0)
+        unknown = random_gesture(markers, frames, seed=1)
+        levels = []
+
+        def banded_dtw_logged(x, y, weights, window=None, upper_bound=np.inf):
+            if window is None:
+                cells = x.shape[1] * y.shape[1]
+            else:
+                cells = np.sum(window[1] - window[0])
+            levels.append(cells)
+            return banded_dtw(x, y, weights, window, upper_bound)
+
+        if tracemalloc is not None:
+            tracemalloc.start()
+        start = time.time()
+        _fastdtw(known, unknown, weights, radius, banded_dtw_logged)
+        duration_sec = time.time() - start
+        if tracemalloc is not None:
+            peak_mb = tracemalloc.get_traced_memory()[1] / 2. ** 20
+            tracemalloc.stop()
+        else:
+            peak_mb = np.nan
+        print("%-9s %-7d %-6d %-14d %12.1f %10.2f" % ("%d s" % duration, frames, len(levels),
+                                                      levels[-1], peak_mb, duration_sec))
+
+
+def kinect_txt_lines(frames, fps=30., seed=None):
+    """
+    :param frames: number of frames
+    :param fps: frames per second
+    :param seed: random seed
+    :return: lines of a random Kinect txt-file
+    """
+    from Kinect.kreader import MARKERS
+    data = random_gesture(MARKERS, frames, seed)
+    rlines = ["\n", "\n", "\n", "<Random>\n", "%d\n" % frames]
+    for frame in range(frames):
+        rlines.append("#%d\n" % frame)
+        sec = 3600. + frame / fps
+        rlines.append("%02d:%02d:%06.3f\n" % (sec // 3600, sec % 3600 // 60, sec % 60))
+        for marker in range(MARKERS):
+            x, y, z = data[marker, frame]
+            rlines.append("\"Marker%d\"\n" % marker)
+            rlines.extend("%.6f\n" % coord for coord in (x, z, y))
+    return rlines
+
+
+def bench_kinect_reader(repeat=3, frames=60, files=100):
+    """
+     Compares the frame by frame Kinect txt parser against the bulk one
+     on the Kinect database (if it's loaded) or on random files otherwise.
+    :param repeat: number of runs per measurement (the best one is taken)
+    :param frames: number of frames per random file
+    :param files: number of random files
+    """
+    from Kinect.kreader import KINECT_PATH, _read_body_by_frames, read_body
+    txt_paths = []
+    for root, dirs, fnames in os.walk(KINECT_PATH):
+        txt_paths.extend(os.path.join(root, fname) for fname in fnames if fname.endswith(".txt"))
+    if txt_paths:
+        source = "database"
+        database = []
+        for txt_path in txt_paths:
+            with open(txt_path, 'r') as rfile:
+                database.append(rfile.readlines())
+    else:
+        source = "random"
+        database = [kinect_txt_lines(frames, seed=seed) for seed in range(files)]
+
+    def parse_all(parser):
+        return [parser(rlines) for rlines in database]
+
+    legacy_dur, legacy_out = time_it(parse_all, repeat, _read_body_by_frames)
+    bulk_dur, bulk_out = time_it(parse_all, repeat, read_body)
+    for (legacy_data, legacy_fps), (bulk_data, bulk_fps) in zip(legacy_out, bulk_out):
+        assert np.array_equal(legacy_data, bulk_data), "kinect data differ"
+        assert np.isclose(legacy_fps, bulk_fps), "kinect fps differ"
+    print("%-9s %-6s %12s %12s %9s" % ("source", "files", "legacy, ms", "bulk, ms", "speedup"))
+    print("%-9s %-6d %12.1f %12.1f %8.1fx" % (source, len(database), 1e3 * legacy_dur,
+                                              1e3 * bulk_dur, legacy_dur / bulk_dur))
+
+
+def bench_c3d_reader(repeat=3):
+    """
+     Compares the frame by frame c3d points reader against the mapped one
+     on the MoCap dataset (if it's available) or on the MoCap demo sample.
+    :param repeat: number of runs per measurement (the best one is taken)
+    """
+    import c3d
+    from MOCAP.mreader import MOCAP_PATH
+    from MOCAP.local_tools.btk_fake import gather_data
+    from MOCAP.local_tools.c3d_points import read_points
+    c3d_paths = []
+    for root, dirs, fnames in os.walk(MOCAP_PATH):
+        c3d_paths.extend(os.path.join(root, fname) for fname in fnames if fname.endswith(".c3d"))
+    if c3d_paths:
+        source = "dataset"
+    else:
+        source = "demo"
+        demo_dir = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "MOCAP", "_data")
+        c3d_paths = [os.path.join(demo_dir, "M1_02_v2_gest1_sample0.c3d")]
+
+    def read_all(by_frames):
+        output = []
+        for c3d_path in c3d_paths:
+            with open(c3d_path, 'rb') as handle:
+                reader = c3d.Reader(handle)
+                output.append(gather_data(reader) if by_frames else read_points(reader, c3d_path))
+        return output
+
+    legacy_dur, legacy_out = time_it(read_all, repeat, True)
+    mapped_dur, mapped_out = time_it(read_all, repeat, False)
+    for legacy_data, mapped_data in zip(legacy_out, mapped_out):
+        assert np.array_equal(legacy_data, mapped_data), "c3d data differ"
+    print("%-9s %-6s %12s %12s %9s" % ("source", "files", "legacy, ms", "mapped, ms", "speedup"))
+    print("%-9s %-6d %12.1f %12.1f %8.1fx" % (source, len(c3d_paths), 1e3 * legacy_dur,
+                                              1e3 * mapped_dur, legacy_dur / mapped_dur))
+
+
+def bench_kalman(repeat=3, markers=28, frames=150, dim=2, gestures=20):
+    """
+     Compares the per-marker Kalman smoothing against the vectorized one
+     on random Emotion-like gestures with gaps.
+    :param repeat: number of runs per measurement (the best one is taken)
+    :param markers: number of markers per gesture
+    :param frames: number of frames per gesture
+    :param dim: number of dimensions
+    :param gestures: number of gestures
+    """
+    from tools.kalman import kalman_1d, kalman_filter
+    rng = np.random.RandomState(0)
+    database = []
+    for _ in range(gestures):
+        data = rng.randn(markers, frames, dim).cumsum(axis=1)
+        data[rng.rand(markers, frames) < 0.05] = np.nan
+        database.append(data)
+
+    def legacy_filter(data):
+        filtered = np.copy(data)
+        for markerID in range(data.shape[0]):
+            for dim_id in range(data.shape[2]):
+                filtered[markerID, :, dim_id] = kalman_1d(data[markerID, :, dim_id])
+        return filtered
+
+    def filter_all(kalman):
+        return [kalman(data) for data in database]
+
+    legacy_dur, legacy_out = time_it(filter_all, repeat, legacy_filter)
+    vect_dur, vect_out = time_it(filter_all, repeat, kalman_filter)
+    for legacy_data, vect_data in zip(legacy_out, vect_out):
+        assert np.allclose(legacy_data, vect_data, equal_nan=True), "kalman outputs differ"
+    print("%-9s %12s %12s %9s" % ("gestures", "legacy, ms", "vect, ms", "speedup"))
+    print("%-9d %12.1f %12.1f %8.1fx" % (gestures, 1e3 * legacy_dur, 1e3 * vect_dur, legacy_dur / vect_dur))
+
+
+def bench_moving_average(repeat=3, markers=40, duration=10, fps=120, wsize=5):
+    """
+     Compares the per-marker moving average against the cumulative sum one
+     on a random MoCap-like gesture.
+    :param repeat: number of runs per measurement (the best one is taken)
+    :param markers: number of markers
+    :param duration: gesture duration in sec
+    :param fps: frames per second
+    :param wsize: window size for averaging
+    """
+    from tools.math_tools import moving_average_simple, moving_average
+    data = random_gesture(markers, duration * fps, seed=0)
+
+    def legacy_average(data):
+        return np.array([[moving_average_simple(data[marker, :, dim], wsize) for dim in range(data.shape[2])]
+                         for marker in range(data.shape[0])]).swapaxes(1, 2)
+
+    legacy_dur, legacy_out = time_it(legacy_average, repeat, data)
+    cumsum_dur, cumsum_out = time_it(moving_average, repeat, data, wsize)
+    assert np.allclose(legacy_out, cumsum_out), "moving averages differ"
+    print("%-9s %12s %12s %9s" % ("frames", "legacy, ms", "cumsum, ms", "speedup"))
+    print("%-9d %12.1f %12.1f %8.1fx" % (data.shape[1], 1e3 * legacy_dur, 1e3 * cumsum_dur,
+                                         legacy_dur / cumsum_dur))
+
+
+if __name__ == "__main__":
+    bench_dtw_engines()
+    bench_fastdtw_levels()
+    bench_kinect_reader()
+    bench_c3d_reader()
+    bench_kalman()
+    bench_moving_average()
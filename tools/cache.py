@@ -0,0 +1,139 @@
+# coding=utf-8
+
+###############################################################
+# On-disk cache of parsed and preprocessed gestures.          #
+# Each source file gets its own .npz entry, which is reused   #
+# until the source file, fps or preprocessing version change. #
+###############################################################
+
+import os
+import json
+import hashlib
+
+import numpy as np
+
+# bump it each time readers or preprocessing change their output
+PREPROCESSING_VERSION = 2
+
+# set GESTURES_CACHE_DIR to an empty string to disable the cache
+CACHE_DIR = os.environ.get("GESTURES_CACHE_DIR",
+                           os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "_cache"))
+
+
+def _source_key(src_path, fps):
+    """
+    :param src_path: path to the gesture source file
+    :param fps: fps requested by the reader
+    :return: dict, which describes the source state
+    """
+    stat = os.stat(src_path)
+    return {
+        "path": os.path.abspath(src_path),
+        "mtime": stat.st_mtime,
+        "size": stat.st_size,
+        "fps": fps,
+        "version": PREPROCESSING_VERSION,
+    }
+
+
+def _cache_path(gest, src_path, fps):
+    """
+    :param gest: BasicMotion instance
+    :param src_path: path to the gesture source file
+    :param fps: fps requested by the reader
+    :return: path to the cache entry
+    """
+    entry_id = "%s|%s|%s" % (type(gest).__name__, os.path.abspath(src_path), fps)
+    entry_name = hashlib.sha1(entry_id.encode("utf-8")).hexdigest() + ".npz"
+    return os.path.join(CACHE_DIR, gest.project, entry_name)
+
+
+def _to_builtin(value):
+    """
+     json fallback for numpy scalars.
+    """
+    if isinstance(value, np.generic):
+        return value.item()
+    raise TypeError("%r is not JSON serializable" % value)
+
+
+def load_gesture(gest, src_path, fps):
+    """
+     Restores gest.cached_fields and gest.cached_arrays from the cache.
+    :param gest: BasicMotion instance with the project set
+    :param src_path: path to the gesture source file
+    :param fps: fps requested by the reader
+    :return: True, if the gesture has been restored, False otherwise
+    """
+    return _load_entry(gest, src_path, fps, gest.cached_arrays)
+
+
+def load_gesture_info(gest, src_path, fps):
+    """
+     Restores gest.cached_fields only; the arrays aren't read.
+    :param gest: BasicMotion instance with the project set
+    :param src_path: path to the gesture source file
+    :param fps: fps requested by the reader
+    :return: True, if the gesture has been restored, False otherwise
+    """
+    return _load_entry(gest, src_path, fps, ())
+
+
+def _load_entry(gest, src_path, fps, array_names):
+    """
+    :param gest: BasicMotion instance with the project set
+    :param src_path: path to the gesture source file
+    :param fps: fps requested by the reader
+    :param array_names: cached arrays to be restored
+    :return: True, if the gesture has been restored, False otherwise
+    """
+    if not CACHE_DIR:
+        return False
+    entry_path = _cache_path(gest, src_path, fps)
+    try:
+        with open(entry_path, 'rb') as entry:
+            npz = np.load(entry)
+            info = json.loads(str(npz["info"]))
+            if info["key"] != _source_key(src_path, fps):
+                # the source has changed
+                return False
+            arrays = {name: npz[name] for name in array_names}
+    except (IOError, OSError, KeyError, ValueError):
+        return False
+    for name, value in info["fields"].items():
+        if isinstance(value, list):
+            value = tuple(value)
+        setattr(gest, name, value)
+    for name, array in arrays.items():
+        setattr(gest, name, array)
+    return True
+
+
+def dump_gesture(gest, src_path, fps):
+    """
+     Saves gest.cached_fields and gest.cached_arrays into the cache.
+    :param gest: preprocessed BasicMotion instance
+    :param src_path: path to the gesture source file
+    :param fps: fps requested by the reader
+    """
+    if not CACHE_DIR:
+        return
+    entry_path = _cache_path(gest, src_path, fps)
+    info = {
+        "key": _source_key(src_path, fps),
+        "fields": {name: getattr(gest, name) for name in gest.cached_fields},
+    }
+    arrays = {name: getattr(gest, name) for name in gest.cached_arrays}
+    tmp_path = "%s.%d.tmp" % (entry_path, os.getpid())
+    try:
+        if not os.path.exists(os.path.dirname(entry_path)):
+            os.makedirs(os.path.dirname(entry_path))
+        with open(tmp_path, 'wb') as entry:
+            np.savez(entry, info=np.array(json.dumps(info, default=_to_builtin)), **arrays)
+        if os.path.exists(entry_path):
+            os.remove(entry_path)
+        os.rename(tmp_path, entry_path)
+    except (IOError, OSError):
+        # the cache is optional: parallel workers may race for the same entry
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
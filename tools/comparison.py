@@ -6,7 +6,10 @@ import matplotlib.cm as cm
 import matplotlib.pyplot as plt
 
 from dtw import dtw
-from tools.fastdtw import dist_measure, fastdtw
+from tools.fastdtw import dist_measure, fastdtw, lb_keogh, lb_kim
+
+# relative slack of lower bounds to be safe against a round-off
+BOUND_TOLERANCE = 1e-9
 
 
 def modify_weights(gest, thrown_labels):
@@ -15,10 +18,11 @@ def modify_weights(gest, thrown_labels):
     :param thrown_labels: labels to be thrown out
     :return: aligned and re-normalized weights
     """
+    weights = gest.get_weights()
     weights_ordered = []
-    for marker in gest.labels:
+    for markerID, marker in enumerate(gest.labels):
         if marker not in thrown_labels:
-            weights_ordered.append(gest.weights[marker])
+            weights_ordered.append(weights[markerID])
     weights_ordered = np.array(weights_ordered)
     weights_ordered /= sum(weights_ordered)
     return weights_ordered
@@ -70,18 +74,13 @@ def align_by_first_frame(known_data, unknown_data):
     return unknown_data
 
 
-def compare(known_gest, unknown_gest, dtw_chosen=fastdtw, weighted=True):
+def prepare_data(known_gest, unknown_gest, weighted=True):
     """
-     Main comparison function for two gesture examples.
-     NOTE:
-        - input gestures must have get_norm_data() and get_weights() methods.
-        - unknown gesture weights are NOT involved into comparison
-          (only known gesture weights are used)
+     Aligns gestures data to be compared.
     :param known_gest: known train sample
     :param unknown_gest: unknown test sample
-    :param dtw_chosen: fastdtw or _dtw (classic)
-    :param weighted: use weighted FastDTW modification or just FastDTW
-    :return: (float), similarity (cost) of the given gestures
+    :param weighted: use known gesture weights or just ones
+    :return: known data, unknown data and weights
     """
     if known_gest.labels == unknown_gest.labels:
         known_data = known_gest.get_norm_data()
@@ -98,11 +97,41 @@ def compare(known_gest, unknown_gest, dtw_chosen=fastdtw, weighted=True):
 
     if not weighted: weights = np.ones(known_data.shape[0])
 
+    return known_data, unknown_data, weights
+
+
+def compare(known_gest, unknown_gest, dtw_chosen=fastdtw, weighted=True, upper_bound=np.inf):
+    """
+     Main comparison function for two gesture examples.
+     NOTE:
+        - input gestures must have get_norm_data() and get_weights() methods
+          (BasicMotion and GestureRecord instances do).
+        - unknown gesture weights are NOT involved into comparison
+          (only known gesture weights are used)
+    :param known_gest: known train sample
+    :param unknown_gest: unknown test sample
+    :param dtw_chosen: fastdtw, banded_dtw or _dtw (classic)
+    :param weighted: use weighted FastDTW modification or just FastDTW
+    :param upper_bound: (float), the cost to be beaten; if the result is known
+                        to exceed it, the comparison is abandoned and np.inf returned
+    :return: (float), similarity (cost) of the given gestures
+    """
+    known_data, unknown_data, weights = prepare_data(known_gest, unknown_gest, weighted)
+
     if not known_data.any() or not unknown_data.any():
         print("Incompatible data dimensions. Returned np.inf")
         return np.inf
 
-    dist, path = dtw_chosen(known_data, unknown_data, weights)
+    if upper_bound < np.inf:
+        # the longest warping path normalizes the cost at most
+        longest_path = known_data.shape[1] + unknown_data.shape[1] - 1
+        dtw_bound = upper_bound * longest_path * (1. + BOUND_TOLERANCE)
+        dist, path = dtw_chosen(known_data, unknown_data, weights, upper_bound=dtw_bound)
+        if dist == np.inf:
+            # abandoned
+            return np.inf
+    else:
+        dist, path = dtw_chosen(known_data, unknown_data, weights)
     if dist == np.inf:
         print("WARNING: dtw comparison gave np.inf")
 
@@ -118,6 +147,28 @@ def compare(known_gest, unknown_gest, dtw_chosen=fastdtw, weighted=True):
     return dist
 
 
+def lower_bound(known_gest, unknown_gest, weighted=True):
+    """
+     Cheap lower bound of compare(known_gest, unknown_gest) result,
+     based on LB_Kim and LB_Keogh bounds of the weighted DTW cost.
+    :param known_gest: known train sample
+    :param unknown_gest: unknown test sample
+    :param weighted: use weighted FastDTW modification or just FastDTW
+    :return: (float), the cost compare() can't go below
+    """
+    known_data, unknown_data, weights = prepare_data(known_gest, unknown_gest, weighted)
+
+    if not known_data.any() or not unknown_data.any():
+        return np.inf
+
+    bound = max(lb_kim(known_data, unknown_data, weights),
+                lb_keogh(known_data, unknown_data, weights))
+
+    # the longest warping path normalizes the cost at most
+    longest_path = known_data.shape[1] + unknown_data.shape[1] - 1
+    return bound / float(longest_path) * (1. - BOUND_TOLERANCE)
+
+
 def show_comparison(known_gest, unknown_gest):
     """
      Shows the result of gestures comparison.
@@ -0,0 +1,241 @@
+# coding=utf-8
+
+##################################################################
+# Pairwise comparison costs of a gestures set, kept on disk.     #
+# Each needed pair is compared once; later variance passes,      #
+# reruns and grown datasets with the same weights reuse the      #
+# stored costs and compare only the missing pairs.               #
+##################################################################
+
+import os
+import sys
+import time
+import hashlib
+import binascii
+
+import numpy as np
+
+from tools.cache import CACHE_DIR
+
+# checkpoint log record: fingerprints of the known and unknown gestures and their cost
+LOG_RECORD = np.dtype([("known", "S20"), ("unknown", "S20"), ("cost", "<f8")])
+
+
+def gesture_key(gest):
+    """
+    :param gest: BasicMotion or GestureRecord instance
+    :return: fingerprint of the gesture data and weights
+    """
+    sha = hashlib.sha1()
+    sha.update(("%s|%s|%s" % (gest.fname, gest.name, "|".join(gest.labels))).encode("utf-8"))
+    sha.update(np.ascontiguousarray(gest.norm_data, dtype=float).tobytes())
+    sha.update(np.asarray(gest.get_weights(), dtype=float).tobytes())
+    return sha.hexdigest()
+
+
+def weights_key(gestures):
+    """
+    :param gestures: BasicMotion or GestureRecord instances
+    :return: fingerprint of the distinct (class name, weights) of the gestures
+    """
+    distinct = set()
+    for gest in gestures:
+        distinct.add((str(gest.name), np.asarray(gest.get_weights(), dtype=float).tobytes()))
+    sha = hashlib.sha1()
+    for name, weights in sorted(distinct):
+        sha.update(name.encode("utf-8"))
+        sha.update(weights)
+    return sha.hexdigest()
+
+
+class DistanceMatrix(object):
+    """
+     costs[i, j] = compare(gestures[i], gestures[j]) for the pairs, which are done.
+     The matrix file is keyed by the dataset, fps and weights fingerprint,
+     and its rows are matched to the gestures by their data and weights fingerprints,
+     so added gestures only add their own rows and columns to be computed.
+     If there is no file for the weights yet, the latest matrix of the dataset
+     is taken as a start (e.g. added classes change the weights fingerprint,
+     but not the weights of the rest).
+     While the missing costs are computed, each done batch of pairs is appended
+     to a checkpoint log next to the matrix file, so an interrupted computation
+     is resumed from the last batch.
+    """
+
+    def __init__(self, gestures, dataset_id, fps, weighted=True):
+        """
+        :param gestures: gestures to be compared (referred to by their ids)
+        :param dataset_id: unique name of the dataset (e.g. the Training folder path)
+        :param fps: frames per second the gestures are loaded with
+        :param weighted: the costs are of weighted FastDTW (True) or just FastDTW (False)
+        """
+        self.gestures = tuple(gestures)
+        self.keys = [gesture_key(gest) for gest in self.gestures]
+        self.weighted = weighted
+        self.costs = np.zeros((len(self.gestures), len(self.gestures)))
+        self.done = np.zeros(self.costs.shape, dtype=bool)
+        self.path = None
+        self.log_path = None
+        if CACHE_DIR:
+            family_id = "%s|%s|%s" % (dataset_id, fps, weighted)
+            self.family = hashlib.sha1(family_id.encode("utf-8")).hexdigest()
+            matrix_name = "%s_%s.npz" % (self.family, weights_key(self.gestures) if weighted else "")
+            self.path = os.path.join(CACHE_DIR, "distances", matrix_name)
+            self.log_path = self.path[:-len(".npz")] + ".log"
+            self.load()
+            self.replay_log()
+
+    def _latest_path(self):
+        """
+        :return: path to the matrix file to start from or None
+        """
+        if os.path.exists(self.path):
+            return self.path
+        dir_path = os.path.dirname(self.path)
+        if not os.path.isdir(dir_path):
+            return None
+        family_paths = [os.path.join(dir_path, fname) for fname in os.listdir(dir_path)
+                        if fname.startswith(self.family) and fname.endswith(".npz")]
+        if not family_paths:
+            return None
+        return max(family_paths, key=os.path.getmtime)
+
+    def load(self):
+        """
+         Takes the stored costs of the gestures, which are still in the set.
+        """
+        matrix_path = self._latest_path()
+        if matrix_path is None:
+            return
+        try:
+            with open(matrix_path, 'rb') as matrix_file:
+                npz = np.load(matrix_file)
+                stored_keys = [str(key) for key in npz["keys"]]
+                stored_costs = npz["costs"]
+                stored_done = npz["done"]
+        except (IOError, OSError, KeyError, ValueError):
+            return
+        position = {key: ind for ind, key in enumerate(self.keys)}
+        stored_ids, ids = [], []
+        for stored_id, key in enumerate(stored_keys):
+            if key in position:
+                stored_ids.append(stored_id)
+                ids.append(position[key])
+        self.costs[np.ix_(ids, ids)] = stored_costs[np.ix_(stored_ids, stored_ids)]
+        self.done[np.ix_(ids, ids)] = stored_done[np.ix_(stored_ids, stored_ids)]
+
+    def replay_log(self):
+        """
+         Takes the costs checkpointed by an interrupted computation.
+        """
+        if not os.path.exists(self.log_path):
+            return
+        with open(self.log_path, 'rb') as log_file:
+            raw = log_file.read()
+        # the last record may be cut off by the interruption
+        records = np.frombuffer(raw[:len(raw) - len(raw) % LOG_RECORD.itemsize], dtype=LOG_RECORD)
+        position = {binascii.unhexlify(key): ind for ind, key in enumerate(self.keys)}
+        for known_key, unknown_key, cost in records:
+            if known_key in position and unknown_key in position:
+                self.costs[position[known_key], position[unknown_key]] = cost
+                self.done[position[known_key], position[unknown_key]] = True
+
+    def checkpoint(self, pairs, costs):
+        """
+         Appends the done pairs to the checkpoint log.
+        :param pairs: (#pairs, 2) known and unknown gestures ids
+        :param costs: (#pairs,) their costs
+        """
+        if self.path is None:
+            return
+        records = np.empty(len(pairs), dtype=LOG_RECORD)
+        records["known"] = [binascii.unhexlify(self.keys[ind]) for ind in pairs[:, 0]]
+        records["unknown"] = [binascii.unhexlify(self.keys[ind]) for ind in pairs[:, 1]]
+        records["cost"] = costs
+        try:
+            if not os.path.exists(os.path.dirname(self.log_path)):
+                os.makedirs(os.path.dirname(self.log_path))
+            with open(self.log_path, 'ab') as log_file:
+                log_file.write(records.tobytes())
+                log_file.flush()
+                os.fsync(log_file.fileno())
+        except (IOError, OSError):
+            pass
+
+    def save(self):
+        """
+         Stores the costs on disk (if the cache is enabled).
+        """
+        if self.path is None:
+            return
+        tmp_path = "%s.%d.tmp" % (self.path, os.getpid())
+        try:
+            if not os.path.exists(os.path.dirname(self.path)):
+                os.makedirs(os.path.dirname(self.path))
+            with open(tmp_path, 'wb') as matrix_file:
+                np.savez(matrix_file, keys=np.array(self.keys), costs=self.costs, done=self.done)
+            if os.path.exists(self.path):
+                os.remove(self.path)
+            os.rename(tmp_path, self.path)
+            # the log is merged into the matrix file
+            if os.path.exists(self.log_path):
+                os.remove(self.log_path)
+        except (IOError, OSError):
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+
+    def compute(self, pairs, scheduler, symmetric=False, verbose=False):
+        """
+         Compares the pairs batch by batch and checkpoints each batch.
+        :param pairs: (#pairs, 2) known and unknown gestures ids
+        :param scheduler: ComparisonScheduler over the gestures
+        :param symmetric: set compare(b, a) to be compare(a, b) as well
+        :param verbose: report progress and ETA after each batch
+        """
+        batch_size = max(1, scheduler.workers) * scheduler.chunk_size
+        start = time.time()
+        for batch_start in range(0, len(pairs), batch_size):
+            batch = pairs[batch_start:batch_start + batch_size]
+            costs = scheduler.costs(batch, self.weighted)
+            self.costs[batch[:, 0], batch[:, 1]] = costs
+            self.done[batch[:, 0], batch[:, 1]] = True
+            if symmetric:
+                self.costs[batch[:, 1], batch[:, 0]] = costs
+                self.done[batch[:, 1], batch[:, 0]] = True
+            self.checkpoint(batch, costs)
+            if verbose:
+                pairs_done = batch_start + len(batch)
+                throughput = pairs_done / max(time.time() - start, 1e-9)
+                eta = (len(pairs) - pairs_done) / throughput
+                sys.stdout.write("\r\t %d / %d pairs (%.1f pairs/sec), ETA: %d sec   "
+                                 % (pairs_done, len(pairs), throughput, eta))
+                sys.stdout.flush()
+        if verbose:
+            print("")
+
+    def get(self, pairs, new_scheduler, symmetric=False, verbose=False):
+        """
+         Computes the missing costs of the pairs and returns all of them.
+        :param pairs: (#pairs, 2) known and unknown gestures ids
+        :param new_scheduler: ComparisonScheduler factory, which takes the gestures;
+                              it's called only if some pairs are missing
+        :param symmetric: take compare(b, a) for compare(a, b), which is true
+                          for gestures with the same weights (e.g. of the same class)
+        :param verbose: report progress of the missing pairs computation
+        :return: (#pairs,) comparison costs
+        """
+        pairs = np.array(pairs, dtype=int).reshape(-1, 2)
+        known, unknown = pairs[:, 0], pairs[:, 1]
+        if symmetric:
+            mirrored = ~self.done[known, unknown] & self.done[unknown, known]
+            self.costs[known[mirrored], unknown[mirrored]] = self.costs[unknown[mirrored], known[mirrored]]
+            self.done[known[mirrored], unknown[mirrored]] = True
+        missing = ~self.done[known, unknown]
+        if missing.any():
+            todo = np.unique(pairs[missing], axis=0)
+            if verbose:
+                print("\t %d pairs out of %d are to be compared" % (len(todo), len(pairs)))
+            with new_scheduler(self.gestures) as scheduler:
+                self.compute(todo, scheduler, symmetric, verbose)
+            self.save()
+        return self.costs[known, unknown]
@@ -10,6 +10,12 @@ import numpy as np
 from numpy.linalg import norm
 from collections import defaultdict
 
+# max number of float elements to be held at once by batched computations
+_BATCH_ELEMENTS = 2 ** 21
+
+# number of blocks to compute local distances by, when DTW may be abandoned
+_ABANDON_BLOCKS = 8
+
 
 def remove_nan(fdata1, fdata2, weights):
     """
@@ -45,45 +51,206 @@ def dist_measure(fdata1, fdata2, weights):
     return np.sum(norm(fdata1 - fdata2, axis=1) * weights)
 
 
-def fastdtw(x, y, weights, radius=1):
+def __nan_free_weights(weights):
+    """
+    :param weights: (#markers,) markers weights (motion contribution)
+    :return: (#markers,) float weights with NaN set to zero
+    """
+    weights = np.array(weights, dtype=float)
+    weights[np.isnan(weights)] = 0.
+    return weights
+
+
+def __weighted_sum(marker_dist, weights):
+    """
+     Vectorized remove_nan: markers with NaN dist are thrown out.
+     Markers are summed up one by one, so the result doesn't depend
+     on how many cells are computed at once.
+    :param marker_dist: (#markers, ...) per marker dist
+    :param weights: (#markers,) NaN-free markers weights
+    :return: (...) weighted dist
+    """
+    marker_dist[np.isnan(marker_dist)] = 0.
+    dist = np.zeros(marker_dist.shape[1:])
+    for weight, dist_per_marker in zip(weights, marker_dist):
+        dist += weight * dist_per_marker
+    return dist
+
+
+def __marker_dist(a, b):
+    """
+     The same as norm(a - b, axis=-1), but without (..., #dim) temporaries.
+    :param a, b: (..., #dim) broadcastable coords
+    :return: (...) euclidean dist
+    """
+    squared = (a[..., 0] - b[..., 0]) ** 2
+    for dim in range(1, a.shape[-1]):
+        squared += (a[..., dim] - b[..., dim]) ** 2
+    return np.sqrt(squared)
+
+
+def dist_matrix(x, y, weights):
+    """
+     Computes dist_measure for all pairs of frames at once.
+     Markers with NaN coords (or NaN weight) are thrown out per frames pair,
+     just like remove_nan does.
+    :param x: (#markers, #frames1, #dim) data of the known gest
+    :param y: (#markers, #frames2, #dim) data of the unknown gest
+    :param weights: (#markers,) markers weights (motion contribution)
+    :return: (#frames1, #frames2) weighted dist matrix
+    """
+    assert x.shape[0] == y.shape[0], "#markers should be the same"
+    weights = __nan_free_weights(weights)
+    dist = np.empty((x.shape[1], y.shape[1]))
+    chunk = max(1, _BATCH_ELEMENTS // max(1, y.size))
+    for start in range(0, x.shape[1], chunk):
+        end = start + chunk
+        # (#markers, #chunk, #frames2)
+        marker_dist = __marker_dist(x[:, start:end, np.newaxis, :], y[:, np.newaxis, :, :])
+        dist[start:end, :] = __weighted_sum(marker_dist, weights)
+    return dist
+
+
+def dist_cells(x, y, weights, rows, cols):
+    """
+     Sparse version of dist_matrix: computes dist_measure only for given cells.
+    :param x: (#markers, #frames1, #dim) data of the known gest
+    :param y: (#markers, #frames2, #dim) data of the unknown gest
+    :param weights: (#markers,) markers weights (motion contribution)
+    :param rows, cols: (#cells,) frame ids of x and y respectively
+    :return: (#cells,) weighted dist per cell
+    """
+    assert x.shape[0] == y.shape[0], "#markers should be the same"
+    weights = __nan_free_weights(weights)
+    dist = np.empty(len(rows))
+    chunk = max(1, _BATCH_ELEMENTS // max(1, x.shape[0] * x.shape[2]))
+    for start in range(0, len(rows), chunk):
+        end = start + chunk
+        # (#markers, #chunk)
+        marker_dist = __marker_dist(x[:, rows[start:end], :], y[:, cols[start:end], :])
+        dist[start:end] = __weighted_sum(marker_dist, weights)
+    return dist
+
+
+def lb_kim(x, y, weights):
+    """
+     LB_Kim lower bound of the weighted DTW cost:
+     each warping path starts at the first frames and ends at the last ones.
+    :param x: (#markers, #frames1, #dim) data of the known gest
+    :param y: (#markers, #frames2, #dim) data of the unknown gest
+    :param weights: (#markers,) markers weights (motion contribution)
+    :return: (float) lower bound of dtw cost
+    """
+    rows = np.array([0, x.shape[1] - 1])
+    cols = np.array([0, y.shape[1] - 1])
+    first, last = dist_cells(x, y, weights, rows, cols)
+    if x.shape[1] == 1 and y.shape[1] == 1:
+        # the first cell is the last one
+        return first
+    return first + last
+
+
+def __envelope_bound(x, y, weights):
+    """
+    :param x: (#markers, #frames1, #dim) data
+    :param y: (#markers, #frames2, #dim) data, which provides the envelope
+    :param weights: (#markers,) markers weights (motion contribution)
+    :return: (float) weighted dist from each frame of x to the y bounding box
+    """
+    weights = __nan_free_weights(weights)
+    # markers with NaN coords in y can be thrown out of any cell
+    weights[np.isnan(y).any(axis=2).any(axis=1)] = 0.
+    lower = y.min(axis=1)[:, np.newaxis, :]
+    upper = y.max(axis=1)[:, np.newaxis, :]
+    outside = np.maximum(lower - x, 0.) + np.maximum(x - upper, 0.)
+    # (#markers, #frames1)
+    marker_dist = np.sqrt(np.sum(outside ** 2, axis=2))
+    return np.sum(__weighted_sum(marker_dist, weights))
+
+
+def lb_keogh(x, y, weights):
+    """
+     LB_Keogh lower bound of the weighted DTW cost.
+     FastDTW has no fixed band, so the envelope covers the whole sequence:
+     each frame of x is aligned to some frame of y, which lies inside
+     the y bounding box for each marker (and vice versa).
+    :param x: (#markers, #frames1, #dim) data of the known gest
+    :param y: (#markers, #frames2, #dim) data of the unknown gest
+    :param weights: (#markers,) markers weights (motion contribution)
+    :return: (float) lower bound of dtw cost
+    """
+    return max(__envelope_bound(x, y, weights), __envelope_bound(y, x, weights))
+
+
+def fastdtw(x, y, weights, radius=1, upper_bound=np.inf):
     """
      Speeds up Weighted DTW algorithm to O(N) complexity.
     :param x: (#markers, #frames1, #dim) data of the known gest
     :param y: (#markers, #frames2, #dim) data of the unknown gest
     :param weights: (#markers,) markers weights (motion contribution)
     :param radius: constrain, defines window searching field
-    :returns: dtw cost, dtw path
+    :param upper_bound: dtw cost to abandon the computation after
+    :returns: dtw cost, dtw path (np.inf, [] if abandoned)
+    """
+    return _fastdtw(x, y, weights, radius, banded_dtw, upper_bound)
+
+
+def _fastdtw(x, y, weights, radius, dtw_engine, upper_bound=np.inf):
+    """
+     FastDTW recursion with a pluggable DTW engine (banded_dtw or _dtw).
+     Shrunk levels don't bound the cost of the full one,
+     so the upper bound is used only on the full level.
+    :param x: (#markers, #frames1, #dim) data of the known gest
+    :param y: (#markers, #frames2, #dim) data of the unknown gest
+    :param weights: (#markers,) markers weights (motion contribution)
+    :param radius: constrain, defines window searching field
+    :param dtw_engine: DTW implementation to be run on each level
+    :param upper_bound: dtw cost to abandon the computation after
+    :returns: dtw cost, dtw path (np.inf, [] if abandoned)
     """
     min_time_size = radius + 2
 
     if x.shape[1] < min_time_size or y.shape[1] < min_time_size:
-        return _dtw(x, y, weights, None)
+        return dtw_engine(x, y, weights, None, upper_bound)
 
     x_shrunk = __reduce_by_half(x)
     y_shrunk = __reduce_by_half(y)
-    distance, path = fastdtw(x_shrunk, y_shrunk, weights, radius)
+    distance, path = _fastdtw(x_shrunk, y_shrunk, weights, radius, dtw_engine)
     window = __expand_window(path, x.shape[1], y.shape[1], radius)
-    return _dtw(x, y, weights, window)
+    return dtw_engine(x, y, weights, window, upper_bound)
 
 
-def _dtw(x, y, weights, window=None):
+def _dtw(x, y, weights, window=None, upper_bound=np.inf):
     """
      Weighted DTW algorithm with O(N^2) complexity.
     :param x: (#markers, #frames1, #dim) data of the known gest
     :param y: (#markers, #frames2, #dim) data of the unknown gest
     :param weights: (#markers,) markers weights (motion contribution)
-    :param window: searching area
-    :returns: dtw cost, dtw path
+    :param window: searching area, (#frames1,) start_j and end_j arrays
+    :param upper_bound: dtw cost to abandon the computation after
+    :returns: dtw cost, dtw path (np.inf, [] if abandoned)
     """
     len_x, len_y = x.shape[1], y.shape[1]
     if window is None:
         window = [(i, j) for i in range(len_x) for j in range(len_y)]
+    else:
+        start_j, end_j = window
+        window = [(i, j) for i in range(len_x) for j in range(start_j[i], end_j[i])]
     window = ((i + 1, j + 1) for i, j in window)
     D = defaultdict(lambda: (float('inf'),))
     D[0, 0] = (0, 0, 0)
+    row, row_min = 1, float('inf')
     for i, j in window:
+        if i != row:
+            # each path goes through each row
+            if row_min > upper_bound:
+                return np.inf, []
+            row, row_min = i, float('inf')
         dt = dist_measure(x[:,i-1,:], y[:,j-1,:], weights)
         D[i, j] = min((D[i-1, j][0]+dt, i-1, j), (D[i, j-1][0]+dt, i, j-1), (D[i-1, j-1][0]+dt, i-1, j-1), key=lambda a: a[0])
+        row_min = min(row_min, D[i, j][0])
+    if D[len_x, len_y][0] > upper_bound:
+        return np.inf, []
     path = []
     i, j = len_x, len_y
     while not (i == j == 0):
@@ -93,6 +260,112 @@ def _dtw(x, y, weights, window=None):
     return D[len_x, len_y][0], path
 
 
+def banded_dtw(x, y, weights, window=None, upper_bound=np.inf):
+    """
+     Weighted DTW algorithm over a preallocated cost array.
+     Only window cells are stored (row by row, without gaps),
+     their local distances are computed in a single batch
+     and the recurrence runs anti-diagonal by anti-diagonal.
+     Returns the same cost and path as _dtw does.
+    :param x: (#markers, #frames1, #dim) data of the known gest
+    :param y: (#markers, #frames2, #dim) data of the unknown gest
+    :param weights: (#markers,) markers weights (motion contribution)
+    :param window: searching area, (#frames1,) start_j and end_j arrays;
+                   pass None to search through the full matrix
+    :param upper_bound: dtw cost to abandon the computation after
+    :returns: dtw cost, dtw path (np.inf, [] if abandoned)
+    """
+    len_x, len_y = x.shape[1], y.shape[1]
+    if window is None:
+        lo = np.zeros(len_x, dtype=int)
+        hi = np.repeat(len_y, len_x)
+    else:
+        lo, hi = window
+    row_size = hi - lo
+    offsets = np.zeros(len_x + 1, dtype=int)
+    offsets[1:] = np.cumsum(row_size)
+    cells_total = offsets[-1]
+    rows = np.repeat(np.arange(len_x), row_size)
+    cols = np.arange(cells_total) - offsets[rows] + lo[rows]
+
+    # two extra slots: out-of-window cell (inf) and the origin (0)
+    outside, origin = cells_total, cells_total + 1
+    cost = np.empty(cells_total + 2)
+    cost[outside] = np.inf
+    cost[origin] = 0.
+
+    # predecessors in the order of _dtw: (i-1, j), (i, j-1), (i-1, j-1)
+    prev_lo = np.append(0, lo[:-1])[rows]
+    prev_hi = np.append(0, hi[:-1])[rows]
+    prev_offset = np.append(0, offsets[:-2])[rows]
+    has_prev_row = rows > 0
+    up = np.where(has_prev_row & (prev_lo <= cols) & (cols < prev_hi),
+                  prev_offset + cols - prev_lo, outside)
+    left = np.where(cols - 1 >= lo[rows], np.arange(cells_total) - 1, outside)
+    diag = np.where(has_prev_row & (prev_lo <= cols - 1) & (cols - 1 < prev_hi),
+                    prev_offset + cols - 1 - prev_lo, outside)
+    diag[(rows == 0) & (cols == 0)] = origin
+    predecessors = np.vstack((up, left, diag))
+
+    if window is None and upper_bound == np.inf:
+        dist = dist_matrix(x, y, weights).ravel()
+        dist_ready = cells_total
+    else:
+        dist = np.empty(cells_total)
+        dist_ready = 0
+    # if the computation may be abandoned, local distances
+    # are computed ahead of the recurrence by blocks
+    dist_block = cells_total if upper_bound == np.inf else cells_total // _ABANDON_BLOCKS + 1
+    steps = np.empty(cells_total, dtype=np.int8)
+
+    # all cells of the same anti-diagonal depend only on the previous ones
+    order = np.argsort(rows + cols, kind="mergesort")
+    diag_bounds = np.cumsum(np.bincount((rows + cols)[order]))
+    start = 0
+    prev_diag_min = np.inf
+    for end in diag_bounds:
+        if end > dist_ready:
+            ahead = order[dist_ready:max(end, dist_ready + dist_block)]
+            dist[ahead] = dist_cells(x, y, weights, rows[ahead], cols[ahead])
+            dist_ready += len(ahead)
+        cells = order[start:end]
+        start = end
+        if len(cells) == 0:
+            # no window cells on this anti-diagonal
+            prev_diag_min = np.inf
+            continue
+        candidates = cost[predecessors[:, cells]] + dist[cells]
+        move = np.argmin(candidates, axis=0)
+        cost[cells] = candidates[move, np.arange(len(cells))]
+        steps[cells] = move
+        if upper_bound < np.inf:
+            # a path can skip one anti-diagonal, but not two in a row
+            diag_min = cost[cells].min()
+            if min(diag_min, prev_diag_min) > upper_bound:
+                return np.inf, []
+            prev_diag_min = diag_min
+
+    total_cost = cost[offsets[len_x - 1] + len_y - 1 - lo[len_x - 1]]
+    if total_cost > upper_bound:
+        # the anti-diagonals check doesn't catch all of such paths
+        return np.inf, []
+
+    path = []
+    i, j = len_x - 1, len_y - 1
+    lo, offsets, steps = lo.tolist(), offsets.tolist(), steps.tolist()
+    while i >= 0 and j >= 0:
+        path.append((i, j))
+        move = steps[offsets[i] + j - lo[i]]
+        if move == 0:
+            i -= 1
+        elif move == 1:
+            j -= 1
+        else:
+            i, j = i - 1, j - 1
+    path.reverse()
+    return total_cost, path
+
+
 def __reduce_by_half(x):
     """
     :param x: (#markers, #frames1, #dim) data
@@ -109,29 +382,31 @@ def __expand_window(path, len_x, len_y, radius):
     :param len_x: #frames1
     :param len_y: #frames2
     :param radius: constrain, defines a window
-    :return: window, expanded by a radius
-    """
-    path_ = set(path)
-    for i, j in path:
-        for a, b in ((i + a, j + b) for a in range(-radius, radius+1) for b in range(-radius, radius+1)):
-            path_.add((a, b))
-
-    window_ = set()
-    for i, j in path_:
-        for a, b in ((i * 2, j * 2), (i * 2, j * 2 + 1), (i * 2 + 1, j * 2), (i * 2 + 1, j * 2 + 1)):
-            window_.add((a, b))
-
-    window = []
-    start_j = 0
-    for i in range(0, len_x):
-        new_start_j = None
-        for j in range(start_j, len_y):
-            if (i, j) in window_:
-                window.append((i, j))
-                if new_start_j is None:
-                    new_start_j = j
-            elif new_start_j is not None:
-                break
-        start_j = new_start_j
-
-    return window
\ No newline at end of file
+    :return: window, expanded by a radius: (#frames1,) start_j and end_j arrays,
+             so that row i spans cells [start_j[i], end_j[i])
+    """
+    path = np.array(path, dtype=int)
+    rows_shrunk = path[-1, 0] + 1
+
+    # path is monotonic, hence each row is spanned by [first j, last j]
+    _, row_first = np.unique(path[:, 0], return_index=True)
+    row_last = np.append(row_first[1:], len(path)) - 1
+    path_lo = path[row_first, 1]
+    path_hi = path[row_last, 1]
+
+    # expanding by a radius; the nearest rows give the extreme j
+    rows = np.arange(rows_shrunk + radius)
+    lo_shrunk = path_lo[np.clip(rows - radius, 0, rows_shrunk - 1)] - radius
+    hi_shrunk = path_hi[np.clip(rows + radius, 0, rows_shrunk - 1)] + radius + 1
+
+    # each shrunk cell turns into 2x2 cells
+    rows = np.arange(len_x) // 2
+    covered = rows < len(lo_shrunk)
+    start_j = np.zeros(len_x, dtype=int)
+    end_j = np.zeros(len_x, dtype=int)
+    start_j[covered] = 2 * lo_shrunk[rows[covered]]
+    end_j[covered] = 2 * hi_shrunk[rows[covered]]
+    start_j = np.maximum.accumulate(np.clip(start_j, 0, len_y))
+    end_j = np.clip(end_j, start_j, len_y)
+
+    return start_j, end_j
@@ -0,0 +1,77 @@
+# coding=utf-8
+
+###################################################################
+# Zero-copy gesture store: norm_data of all gestures is packed    #
+# into a single shared memory block, which worker processes       #
+# attach to instead of receiving their own copies of the dataset. #
+###################################################################
+
+import numpy as np
+
+from tools.record import GestureRecord
+
+try:
+    from multiprocessing import shared_memory
+except ImportError:
+    # Python < 3.8: gestures are to be pickled
+    shared_memory = None
+
+
+class SharedGestureStore(object):
+    """
+     Packs norm_data of the gestures into one shared memory block.
+     The block holds a ragged layout: gestures lie one by one,
+     and the layout (offsets, shapes, labels, weights) is small enough
+     to be pickled to the workers, which attach to the block by its name.
+    """
+
+    def __init__(self, gestures):
+        """
+        :param gestures: gestures to be stored (their weights are taken as is)
+        """
+        assert shared_memory is not None, "shared memory requires Python 3.8+"
+        shapes = [gest.norm_data.shape for gest in gestures]
+        offsets = np.cumsum([0] + [int(np.prod(shape)) for shape in shapes])
+        itemsize = np.dtype(float).itemsize
+        self.shm = shared_memory.SharedMemory(create=True, size=max(1, int(offsets[-1]) * itemsize))
+        packed = np.ndarray(int(offsets[-1]), dtype=float, buffer=self.shm.buf)
+        for gest, start, end in zip(gestures, offsets[:-1], offsets[1:]):
+            packed[start:end] = gest.norm_data.ravel()
+        del packed
+        self.layout = {
+            "block": self.shm.name,
+            "offsets": offsets[:-1].tolist(),
+            "shapes": shapes,
+            "names": [gest.name for gest in gestures],
+            "fnames": [gest.fname for gest in gestures],
+            "labels": [tuple(gest.labels) for gest in gestures],
+            "weights": [gest.get_weights() for gest in gestures],
+            "fps": [gest.fps for gest in gestures],
+        }
+
+    def close(self):
+        """
+         Frees the shared memory block.
+         Workers should have been stopped by then.
+        """
+        if self.shm is not None:
+            self.shm.close()
+            self.shm.unlink()
+            self.shm = None
+
+
+def attach(layout):
+    """
+    :param layout: SharedGestureStore layout
+    :return: shared memory block (keep it while the gestures are used),
+             tuple of GestureRecord views over the block
+    """
+    shm = shared_memory.SharedMemory(name=layout["block"])
+    itemsize = np.dtype(float).itemsize
+    gestures = []
+    for ind, shape in enumerate(layout["shapes"]):
+        norm_data = np.ndarray(shape, dtype=float, buffer=shm.buf, offset=layout["offsets"][ind] * itemsize)
+        norm_data.setflags(write=False)
+        gestures.append(GestureRecord(layout["names"][ind], layout["labels"][ind], norm_data,
+                                      layout["weights"][ind], layout["fps"][ind], layout["fnames"][ind]))
+    return shm, tuple(gestures)
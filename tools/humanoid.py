@@ -6,12 +6,14 @@ from mpl_toolkits.mplot3d import Axes3D
 from numpy.linalg import norm
 
 from tools.basic import BasicMotion
+from tools.kalman import KalmanStream
 
 
 class HumanoidBasic(BasicMotion):
     """
      Constructs a humanoid with empty fields and basic methods.
     """
+    cached_fields = BasicMotion.cached_fields + ("shoulder_width",)
 
     def __init__(self, fps):
         """
@@ -98,3 +100,35 @@ class HumanoidBasic(BasicMotion):
             self.pts[marker].set_data([x], [y])
             self.pts[marker].set_3d_properties([z])
         return []
+
+
+class HumanoidNormStream(object):
+    """
+     HumanoidBasic.preprocessing of live data, which comes by chunks of frames.
+     The whole gesture averages of the shoulder center and width aren't known
+     in a stream, so they are tracked by a slow KalmanStream instead.
+    """
+
+    def __init__(self, labels, shoulder_markers, k_stab=0.02):
+        """
+        :param labels: markers names of the stream frames
+        :param shoulder_markers: left, center and right shoulder markers names
+        :param k_stab: kalman stable gain of the shoulder center and width tracking
+        """
+        sh_left, sh_center, sh_right = shoulder_markers
+        self.center_id = labels.index(sh_center)
+        self.sh_ids = labels.index(sh_left), labels.index(sh_right)
+        self.center_stream = KalmanStream(k_stab)
+        self.width_stream = KalmanStream(k_stab)
+
+    def update(self, chunk):
+        """
+        :param chunk: (#markers, #frames, 3) next frames
+        :return: (#markers, #frames, 3) normalized frames
+                 (NaN till both shoulder center and width are seen)
+        """
+        chunk = np.asarray(chunk, dtype=float)
+        shoulder_center = self.center_stream.update(chunk[self.center_id, np.newaxis])
+        sh_diff = chunk[self.sh_ids[0]] - chunk[self.sh_ids[1]]
+        shoulder_width = self.width_stream.update(norm(sh_diff, axis=1)[np.newaxis, :, np.newaxis])
+        return (chunk - shoulder_center) / shoulder_width
@@ -5,24 +5,152 @@ import time
 import json
 import sys
 
-import concurrent
-from concurrent.futures import ProcessPoolExecutor
-
 import numpy as np
 from numpy.linalg import norm
 import matplotlib.pyplot as plt
 
-from tools.comparison import compare, show_comparison
-from tools.fastdtw import fastdtw
+from tools.basic import weights_from_displacements
+from tools.comparison import lower_bound, show_comparison
+from tools.distance_matrix import DistanceMatrix
+from tools.project_info import forget
+from tools.prototypes import class_prototypes, save_prototypes, load_prototypes
+from tools.record import GestureRecord
+from tools.recognizer import StreamingRecognizer
+from tools.scheduler import ComparisonScheduler
 from Kinect.kreader import KINECT_PATH
 from MOCAP.mreader import MOCAP_PATH
 from Emotion.em_reader import EMOTION_PATH
 
 
+def nearest_costs(scheduler, pattern_ids, unknown_id, weighted, prune=True):
+    """
+     Computes comparison costs of the unknown gesture against all patterns,
+     but only the min cost is guaranteed to be exact:
+     patterns are compared in the order of their lower bounds,
+     those, which can't beat the best-so-far cost, are skipped,
+     and the rest are abandoned as soon as they exceed it.
+    :param scheduler: ComparisonScheduler instance
+    :param pattern_ids: scheduler ids of known gestures
+    :param unknown_id: scheduler id of unknown test sample
+    :param weighted: use weighted FastDTW modification or just FastDTW
+    :param prune: skip (True) or compute (False) hopeless comparisons
+    :return: (#patterns,) costs (np.inf for skipped and abandoned patterns),
+             number of skipped patterns
+    """
+    pattern_ids = np.asarray(pattern_ids, dtype=int)
+    costs = np.repeat(np.inf, len(pattern_ids))
+    if prune:
+        unknown_gest = scheduler.gestures[unknown_id]
+        bounds = np.array([lower_bound(scheduler.gestures[pattern_id], unknown_gest, weighted)
+                           for pattern_id in pattern_ids])
+        batch_size = max(1, scheduler.workers)
+    else:
+        bounds = np.zeros(len(pattern_ids))
+        batch_size = max(1, len(pattern_ids))
+    order = np.argsort(bounds, kind="mergesort")
+    best_cost = np.inf
+    computed = 0
+    while computed < len(order) and bounds[order[computed]] <= best_cost:
+        batch = [ind for ind in order[computed:computed + batch_size] if bounds[ind] <= best_cost]
+        pairs = [(pattern_ids[ind], unknown_id) for ind in batch]
+        costs[batch] = scheduler.costs(pairs, weighted, best_cost)
+        best_cost = min(best_cost, min(costs[batch]))
+        computed += len(batch)
+    return costs, len(pattern_ids) - computed
+
+
+class GestureDataset(object):
+    """
+     Training or Testing split, loaded and preprocessed once.
+     Gestures are kept in memory along with their class indices,
+     so weights can be recomputed without re-reading the files.
+    """
+
+    def __init__(self, MotionClass, split_path, fps, lazy=False):
+        """
+        :param MotionClass: gesture class (HumanoidKinect, HumanoidUkr, Emotion, etc.)
+        :param split_path: path to the Training or Testing folder
+        :param fps: frames per second to be set;
+                    pass as None to use the default fps
+        :param lazy: create lazy gestures, which read their data on the first access to it
+                     (cheap listing: metadata is taken from the gestures cache)
+        """
+        self.MotionClass = MotionClass
+        self.path = split_path
+        self.fps = fps
+        class_names = []
+        gestures = []
+        class_ids = []
+        for class_name in os.listdir(split_path):
+            class_path = os.path.join(split_path, class_name)
+            for short_name in os.listdir(class_path):
+                gest_path = os.path.join(class_path, short_name)
+                if lazy:
+                    gestures.append(MotionClass(gest_path, fps, lazy=True))
+                else:
+                    gestures.append(MotionClass(gest_path, fps))
+                class_ids.append(len(class_names))
+            class_names.append(class_name)
+        self.class_names = tuple(class_names)
+        self.gestures = tuple(gestures)
+        self.class_ids = np.array(class_ids, dtype=int)
+
+    def __len__(self):
+        return len(self.gestures)
+
+    def __iter__(self):
+        return iter(self.gestures)
+
+    def __getitem__(self, ind):
+        return self.gestures[ind]
+
+    def class_indices(self, class_name):
+        """
+        :param class_name: folder name of the class
+        :return: indices of the given class gestures
+        """
+        class_id = self.class_names.index(class_name)
+        return np.where(self.class_ids == class_id)[0]
+
+    def class_gestures(self, class_name):
+        """
+        :param class_name: folder name of the class
+        :return: gestures of the given class
+        """
+        return tuple(self.gestures[ind] for ind in self.class_indices(class_name))
+
+    def records(self, dtype=np.float64):
+        """
+        :param dtype: norm_data type to be kept; pass np.float32 to halve the memory
+        :return: compact GestureRecord copies of the gestures
+        """
+        return tuple(GestureRecord.from_motion(gest, dtype) for gest in self.gestures)
+
+    def set_weights(self):
+        """
+         Reloads gestures weights from _INFO.json.
+        """
+        for gest in self.gestures:
+            gest.set_weights()
+
+
 class InstrumentCollector(object):
-    def __init__(self, MotionClass, prefix=""):
+    def __init__(self, MotionClass, prefix="", workers=None, chunk_size=64, shared=True):
+        """
+        :param MotionClass: gesture class (HumanoidKinect, HumanoidUkr, Emotion, etc.)
+        :param prefix: project folder with Training and Testing data;
+                       pass as "" to use the default one
+        :param workers: number of comparison processes (see ComparisonScheduler);
+                        pass as None to use all cpu, 0 to compare serially
+        :param chunk_size: max number of comparisons to be sent to a process at once
+        :param shared: share gestures data with the processes through shared memory
+                       (True) or send each process its own copy (False)
+        """
         self.MotionClass = MotionClass
         self.prefix = prefix
+        self.workers = workers
+        self.chunk_size = chunk_size
+        self.shared = shared
         self.script_dir_path = os.path.dirname(sys.argv[0])
         _paths = dict(HumanoidUkr=MOCAP_PATH,
                       HumanoidKinect=KINECT_PATH,
@@ -64,67 +192,176 @@ class InstrumentCollector(object):
 
     def dump_info(self):
         proj_info_path = os.path.join(self.script_dir_path, self._info_name)
-        json.dump(self.proj_info, open(proj_info_path, 'w'))
+        with open(proj_info_path, 'w') as proj_info_file:
+            json.dump(self.proj_info, proj_info_file)
+        # the gestures read the weights through the registry
+        forget(proj_info_path)
+
+    def prototypes_path(self):
+        """
+        :return: path to PROJECT_PROTOTYPES.npz, which is kept next to PROJECT_INFO.json
+        """
+        return os.path.join(self.script_dir_path, self._info_name.replace("_INFO.json", "_PROTOTYPES.npz"))
 
-    def load_train_samples(self, fps):
+    def load_prototypes(self):
+        """
+        :return: {class folder name: list of GestureRecord prototypes}
+        """
+        return load_prototypes(self.prototypes_path())
+
+    def streaming_recognizer(self, labels, fps, thresholds=None, max_latency=None):
+        """
+        :param labels: markers names of the stream frames
+        :param fps: stream frames per second
+        :param thresholds: max normalized cost of a detection (float or {class name: cost});
+                           pass None to use within-variance from PROJECT_INFO.json
+        :param max_latency: see SpringTemplate
+        :return: StreamingRecognizer of the class prototypes (see Training.build_prototypes)
+        """
+        if thresholds is None:
+            self.load_info()
+            thresholds = self.proj_info["within_variance"]
+        templates = []
+        for class_prototypes_list in self.load_prototypes().values():
+            templates.extend(class_prototypes_list)
+        return StreamingRecognizer(templates, labels, fps, thresholds, max_latency)
+
+    def load_train_set(self, fps, lazy=False):
         """
         :param fps: frames per second to be set;
                     pass as None to use the default fps
-        :return: training gestures
+        :param lazy: create lazy gestures (see GestureDataset)
+        :return: GestureDataset of training gestures
         """
-        train_gestures = []
-        for class_name in os.listdir(self.trn_path):
-            class_path = os.path.join(self.trn_path, class_name)
-            for trn_name in os.listdir(class_path):
-                fpath_trn = os.path.join(class_path, trn_name)
-                gest = self.MotionClass(fpath_trn, fps)
-                train_gestures.append(gest)
-        return tuple(train_gestures)
+        return GestureDataset(self.MotionClass, self.trn_path, fps, lazy)
 
-    def load_test_samples(self, fps):
+    def load_test_set(self, fps, lazy=False):
         """
         :param fps: frames per second to be set;
                     pass as None to use the default fps
-        :return: testing gestures
+        :param lazy: create lazy gestures (see GestureDataset)
+        :return: GestureDataset of testing gestures
+        """
+        return GestureDataset(self.MotionClass, self.tst_path, fps, lazy)
+
+    def comparison_scheduler(self, gestures):
+        """
+        :param gestures: gestures to be compared
+        :return: ComparisonScheduler instance
+        """
+        return ComparisonScheduler(gestures, self.workers, self.chunk_size, self.shared)
+
+    def distance_matrix(self, fps, trn_set):
+        """
+        :param fps: frames per second the trn_set is loaded with
+        :param trn_set: training GestureDataset with the current weights
+        :return: DistanceMatrix of weighted comparisons of the trn_set gestures
         """
-        test_gestures = []
-        for directory in os.listdir(self.tst_path):
-            tst_subfolder = os.path.join(self.tst_path, directory)
-            for tst_name in os.listdir(tst_subfolder):
-                fpath_tst = os.path.join(tst_subfolder, tst_name)
-                gest = self.MotionClass(fpath_tst, fps)
-                test_gestures.append(gest)
-        return tuple(test_gestures)
+        dataset_id = "%s|%s" % (self.MotionClass.__name__, os.path.abspath(trn_set.path))
+        return DistanceMatrix(trn_set.gestures, dataset_id, fps)
 
-    def compute_weights(self, mode, beta, fps):
+    def _train_set(self, fps, trn_set=None):
+        """
+        :param fps: frames per second to be set
+        :param trn_set: already loaded GestureDataset or None
+        :return: training GestureDataset with the given fps
+        """
+        if trn_set is None:
+            trn_set = self.load_train_set(fps)
+        assert trn_set.fps == fps, "training set is loaded with another fps"
+        return trn_set
+
+    def _test_set(self, fps, tst_set=None):
+        """
+        :param fps: frames per second to be set
+        :param tst_set: already loaded GestureDataset or None
+        :return: testing GestureDataset with the given fps
+        """
+        if tst_set is None:
+            tst_set = self.load_test_set(fps)
+        assert tst_set.fps == fps, "testing set is loaded with another fps"
+        return tst_set
+
+    def load_train_samples(self, fps, archive=None):
+        """
+        :param fps: frames per second to be set;
+                    pass as None to use the default fps
+        :param archive: GestureArchive to read the gestures from
+                        instead of walking the Training directory
+        :return: training gestures (GestureRecord views, if read from the archive)
+        """
+        if archive is not None:
+            return archive.records("Training", fps)
+        return self.load_train_set(fps).gestures
+
+    def load_test_samples(self, fps, archive=None):
+        """
+        :param fps: frames per second to be set;
+                    pass as None to use the default fps
+        :param archive: GestureArchive to read the gestures from
+                        instead of walking the Testing directory
+        :return: testing gestures (GestureRecord views, if read from the archive)
+        """
+        if archive is not None:
+            return archive.records("Testing", fps)
+        return self.load_test_set(fps).gestures
+
+    def compute_weights(self, mode, beta, fps, trn_set=None):
         """
          Computes aver weights from the Training dataset.
+         Gestures of the trn_set get the new aver weights afterwards.
         :param mode: defines moving markers
         :param beta: (float), defines weights activity;
                       the best beta value is around 1e2;
                       set it to None to model when beta vanishes;
         :param fps: frames per second to be set;
                     pass as None to use the default fps
+        :param trn_set: training GestureDataset to be reused
+        """
+        trn_set = self._train_set(fps, trn_set)
+        global_weights = self.weights_sweep(mode, (beta,), fps, trn_set)[0]
+        self.save_weights(beta, global_weights, trn_set)
+
+    def weights_sweep(self, mode, betas, fps, trn_set=None):
+        """
+         Computes aver weights from the Training dataset for many betas at once:
+         joints displacements of each gesture are computed only once.
+        :param mode: defines moving markers
+        :param betas: beta values (see compute_weights)
+        :param fps: frames per second to be set;
+                    pass as None to use the default fps
+        :param trn_set: training GestureDataset to be reused
+        :return: list of {class name: aver weights} dicts, one per beta
+        """
+        trn_set = self._train_set(fps, trn_set)
+        sweep = [{} for _ in betas]
+        for directory in trn_set.class_names:
+            displacements = []
+            moving_num = []
+            for gest in trn_set.class_gestures(directory):
+                displacements.append(gest.compute_displacement(mode)[0])
+                moving_num.append(len(gest.moving_markers))
+
+            # (#gestures, #betas, #markers) weights; files with NaN weights are skipped
+            weights = weights_from_displacements(displacements, betas, moving_num)
+            valid = ~np.isnan(weights).any(axis=2)
+            assert valid.any(axis=0).all(), "too many files with NaN weights"
+            weights[~valid] = 0.
+            aver_weights = np.sum(weights, axis=0) / valid.sum(axis=0)[:, np.newaxis]
+            for beta_id, beta_weights in enumerate(aver_weights):
+                sweep[beta_id][directory] = beta_weights.tolist()
+        return sweep
+
+    def save_weights(self, beta, global_weights, trn_set):
+        """
+         Saves aver weights in PROJECT_INFO.json
+         and sets them in gestures of the trn_set.
+        :param beta: beta, the weights are computed with
+        :param global_weights: {class name: aver weights}
+        :param trn_set: training GestureDataset
         """
         self.load_info()
         self.proj_info["beta"] = beta
-
-        global_weights = {}
-
-        for directory in os.listdir(self.trn_path):
-            global_weights[directory] = []
-            current_dir_weights = []
-            trn_subfolder = os.path.join(self.trn_path, directory)
-            for trn_name in os.listdir(trn_subfolder):
-                fpath_trn = os.path.join(trn_subfolder, trn_name)
-                gest = self.MotionClass(fpath_trn, fps)
-                gest.compute_weights(mode, beta)
-                weights_array = gest.get_weights()
-                if np.isnan(weights_array).any(): continue
-                current_dir_weights.append(weights_array)
-            assert len(current_dir_weights) > 0, "too many files with NaN weights"
-            global_weights[directory] = np.average(current_dir_weights, axis=0).tolist()
-
         if self.prefix == "":
             self.proj_info["weights"] = global_weights
         else:
@@ -132,16 +369,24 @@ class InstrumentCollector(object):
             self.proj_info["weights"][sub_project] = global_weights
 
         self.dump_info()
+        trn_set.set_weights()
         print("New weights are saved in %s" % self._info_name)
 
-    def compute_average_duration(self):
+    def compute_average_duration(self, trn_set=None, tst_set=None):
         """
         Computes average gesture duration in sec across train + test samples.
 
+        :param trn_set: training GestureDataset (default fps) to be reused
+        :param tst_set: testing GestureDataset (default fps) to be reused
         :return: average gesture duration
         """
+        # only frames and fps are needed, so the data isn't read
+        if trn_set is None:
+            trn_set = self.load_train_set(None, lazy=True)
+        if tst_set is None:
+            tst_set = self.load_test_set(None, lazy=True)
         durations_total = 0
-        samples = self.load_test_samples(fps=None) + self.load_train_samples(fps=None)
+        samples = self._test_set(None, tst_set).gestures + self._train_set(None, trn_set).gestures
         for _sample in samples:
             durations_total += float(_sample.frames) / _sample.fps
         return durations_total / len(samples)
@@ -152,10 +397,10 @@ class InstrumentCollector(object):
 ########################################################################################################################
 
 class Testing(InstrumentCollector):
-    def __init__(self, MotionClass, prefix=""):
-        InstrumentCollector.__init__(self, MotionClass, prefix)
+    def __init__(self, MotionClass, prefix="", workers=None, chunk_size=64, shared=True):
+        InstrumentCollector.__init__(self, MotionClass, prefix, workers, chunk_size, shared)
 
-    def the_worst_comparison(self, fps, verbose=True, weighted=True):
+    def the_worst_comparison(self, fps, verbose=True, weighted=True, prune=True, trn_set=None, tst_set=None):
         """
          Computes the worst and the best out-of-sample error, using WDTW algorithm.
          The confidence measure is set to be a margin between the chosen positive
@@ -164,10 +409,12 @@ class Testing(InstrumentCollector):
                     pass as None to use the default fps
         :param verbose: verbose display (True) or silent (False)
         :param weighted: use weighted FastDTW modification or just FastDTW
+        :param prune: skip comparisons with other classes patterns,
+                      which can't beat the best-so-far cost (the result is the same)
+        :param trn_set: training GestureDataset to be reused
+        :param tst_set: testing GestureDataset to be reused
         """
 
-        executor = ProcessPoolExecutor()
-
         def print_err(got_pattern, unknownGest):
             if verbose:
                 msg = "got %s" % got_pattern.name
@@ -186,87 +433,79 @@ class Testing(InstrumentCollector):
         print("%s: TWE WORST COMPARISON is running (FPS = %s)" % (self.MotionClass.__name__, fps))
         start = time.time()
         self.load_info()
+        trn_set = self._train_set(fps, trn_set)
+        tst_set = self._test_set(fps, tst_set)
 
         patterns = {}
         supremum = {}
         infimum = {}
         margin = 0
-
-        for directory in os.listdir(self.trn_path):
-            patterns[directory] = []
-            infimum[directory] = 0.
-            supremum[directory] = 0.
-            trn_subdir = os.path.join(self.trn_path, directory)
-            for short_name in os.listdir(trn_subdir):
-                fname = os.path.join(trn_subdir, short_name)
-                knownOtherGest = self.MotionClass(fname, fps)
-                patterns[directory].append(knownOtherGest)
-        
-        for directory in os.listdir(self.tst_path):
-            tst_subfolder = os.path.join(self.tst_path, directory)
-            if verbose: print(" testing '%s'" % directory)
-            for _sampleID, test_name in enumerate(os.listdir(tst_subfolder)):
-                fpath_test = os.path.join(tst_subfolder, test_name)
-                unknownGest = self.MotionClass(fpath_test, fps)
-                the_same_costs = []
-                other_costs = []
-                other_patterns = []
-                futures_list = []
-
-                for theSamePattern in patterns[directory]:
-                    future = executor.submit(compare, *(theSamePattern, unknownGest, fastdtw, weighted))
-                    future.is_the_same_pattern = True
-                    futures_list.append(future)
-
-                for class_name, gestsLeft in patterns.items():
-                    if class_name != directory:
-                        for knownOtherGest in gestsLeft:
-                            other_patterns.append(knownOtherGest)
-                            future = executor.submit(compare, *(knownOtherGest, unknownGest, fastdtw, weighted))
-                            future.is_the_same_pattern = False
-                            futures_list.append(future)
-
-                results_collected = concurrent.futures.wait(futures_list)
-                assert len(results_collected.not_done) == 0, "failed to compute async"
-
-                for future_completed in results_collected.done:
-                    dist = future_completed.result()
-                    if future_completed.is_the_same_pattern:
-                        the_same_costs.append(dist)
-                    else:
-                        other_costs.append(dist)
-
-                min_other_cost = min(other_costs)
-                min_the_same_cost = min(the_same_costs)
-                max_the_same_cost = max(the_same_costs)
-
-                if max_the_same_cost >= min_other_cost:
-                    # the worst test scenario is FAILED
-                    ind = np.argmin(other_costs)
-                    got_pattern = other_patterns[ind]
-                    assert got_pattern.name != unknownGest.name, "invalid data structure"
-                    supremum[directory] += 1.
-                    # print_err(got_pattern, unknownGest)
-
-                if min_the_same_cost >= min_other_cost:
-                    # both the worst and the best test scenarios are FAILED
-                    ind = np.argmin(other_costs)
-                    got_pattern = other_patterns[ind]
-                    assert got_pattern.name != unknownGest.name, "invalid data structure"
-                    infimum[directory] += 1
-                    print_err(got_pattern, unknownGest)
-
-                if len(the_same_costs) > 1:
-                    # estimate margin
-                    interval = max_the_same_cost - min_the_same_cost
-                    how_good = (min_other_cost - min_the_same_cost) / interval
-                    margin += min(1, max(0, how_good))
+        comparisons_total = 0
+        comparisons_pruned = 0
+
+        # patterns are referred to by their ids in the scheduler
+        with self.comparison_scheduler(trn_set.gestures + tst_set.gestures) as scheduler:
+            tst_offset = len(trn_set)
+
+            for directory in trn_set.class_names:
+                patterns[directory] = trn_set.class_indices(directory)
+                infimum[directory] = 0.
+                supremum[directory] = 0.
+
+            # all the same class costs are needed to get both min and max,
+            # so they are computed at once
+            the_same_pairs = []
+            for directory in tst_set.class_names:
+                for unknown_id in tst_offset + tst_set.class_indices(directory):
+                    the_same_pairs.extend((pattern_id, unknown_id) for pattern_id in patterns[directory])
+            the_same_costs_left = iter(scheduler.costs(the_same_pairs, weighted))
+
+            for directory in tst_set.class_names:
+                if verbose: print(" testing '%s'" % directory)
+                for unknown_id in tst_offset + tst_set.class_indices(directory):
+                    unknownGest = scheduler.gestures[unknown_id]
+                    the_same_costs = [next(the_same_costs_left) for _ in patterns[directory]]
+
+                    other_patterns = []
+                    for class_name, class_ids in patterns.items():
+                        if class_name != directory:
+                            other_patterns.extend(class_ids)
+
+                    # whereas only the min cost matters among other classes
+                    other_costs, pruned = nearest_costs(scheduler, other_patterns, unknown_id, weighted, prune)
+                    comparisons_total += len(the_same_costs) + len(other_patterns)
+                    comparisons_pruned += pruned
+
+                    min_other_cost = min(other_costs)
+                    min_the_same_cost = min(the_same_costs)
+                    max_the_same_cost = max(the_same_costs)
+
+                    if max_the_same_cost >= min_other_cost:
+                        # the worst test scenario is FAILED
+                        ind = np.argmin(other_costs)
+                        got_pattern = scheduler.gestures[other_patterns[ind]]
+                        assert got_pattern.name != unknownGest.name, "invalid data structure"
+                        supremum[directory] += 1.
+                        # print_err(got_pattern, unknownGest)
+
+                    if min_the_same_cost >= min_other_cost:
+                        # both the worst and the best test scenarios are FAILED
+                        ind = np.argmin(other_costs)
+                        got_pattern = scheduler.gestures[other_patterns[ind]]
+                        assert got_pattern.name != unknownGest.name, "invalid data structure"
+                        infimum[directory] += 1
+                        print_err(got_pattern, unknownGest)
+
+                    if len(the_same_costs) > 1:
+                        # estimate margin
+                        interval = max_the_same_cost - min_the_same_cost
+                        how_good = (min_other_cost - min_the_same_cost) / interval
+                        margin += min(1, max(0, how_good))
 
         total_samples = 0
         print("The result is shown in number of misclassified samples: ")
         for dir in supremum.keys():
-            tst_subfolder = os.path.join(self.tst_path, dir)
-            tst_samples = len(os.listdir(tst_subfolder))
+            tst_samples = len(tst_set.class_gestures(dir))
             total_samples += tst_samples
             if verbose:
                 msg = "  %s: \t\t min = %d, max = %d out of %d test samples" % (
@@ -281,14 +520,98 @@ class Testing(InstrumentCollector):
         print("*** THE BEST CASE: %d; \tTHE WORST CASE: %d; \t TOTAL SAMPLES: %d" %
               (total_infimum, total_supremum, total_samples))
         print("*** margin: %.3g%%" % margin)
+        if prune:
+            pruned_fraction = float(comparisons_pruned) / max(1, comparisons_total)
+            self.proj_info["pruned"] = pruned_fraction
+            print("*** pruned: %d out of %d comparisons (%.1f%%)" % (comparisons_pruned, comparisons_total,
+                                                                   100. * pruned_fraction))
         duration = time.time() - start
         print("Duration: %d sec" % duration)
 
-        executor.shutdown()
-
         return total_infimum, total_supremum, total_samples
 
 
+    def prototype_comparison(self, fps, ambiguity=0.1, verbose=True, weighted=True, prune=True,
+                             trn_set=None, tst_set=None):
+        """
+         Computes the out-of-sample error, comparing each test sample
+         with the class prototypes (see Training.build_prototypes) first.
+         Only if the nearest prototype isn't far enough ahead of the nearest prototype
+         of another class, the sample is classified by its nearest training sample.
+        :param fps: fps to be set in each gesture;
+                    pass as None to use the default fps
+        :param ambiguity: the prototypes answer is taken if the nearest prototype of another
+                          class costs more than (1 + ambiguity) times the nearest one
+        :param verbose: verbose display (True) or silent (False)
+        :param weighted: use weighted FastDTW modification or just FastDTW
+        :param prune: skip hopeless comparisons with the training samples
+        :param trn_set: training GestureDataset to be reused
+        :param tst_set: testing GestureDataset to be reused
+        :return: number of misclassified samples, total samples
+        """
+        print("%s: PROTOTYPE COMPARISON is running (FPS = %s)" % (self.MotionClass.__name__, fps))
+        start = time.time()
+        self.load_info()
+        tst_set = self._test_set(fps, tst_set)
+        prototypes = []
+        for class_prototypes_list in self.load_prototypes().values():
+            prototypes.extend(class_prototypes_list)
+        assert all(proto.fps == tst_set[0].fps for proto in prototypes), "prototypes are built with another fps"
+
+        proto_ids = np.arange(len(prototypes))
+        errors = 0
+        fallbacks = 0
+        comparisons = 0
+
+        with self.comparison_scheduler(tuple(prototypes) + tst_set.gestures) as scheduler:
+            tst_offset = len(prototypes)
+            proto_pairs = [(proto_id, unknown_id) for unknown_id in tst_offset + np.arange(len(tst_set))
+                           for proto_id in proto_ids]
+            proto_costs = scheduler.costs(proto_pairs, weighted).reshape(len(tst_set), len(prototypes))
+        comparisons += proto_costs.size
+
+        ambiguous = []
+        for tst_id, unknownGest in enumerate(tst_set):
+            order = np.argsort(proto_costs[tst_id])
+            got_pattern = prototypes[order[0]]
+            others = [proto_id for proto_id in order if prototypes[proto_id].name != got_pattern.name]
+            best_cost = proto_costs[tst_id, order[0]]
+            if others and proto_costs[tst_id, others[0]] <= (1. + ambiguity) * best_cost:
+                ambiguous.append(tst_id)
+            elif got_pattern.name != unknownGest.name:
+                errors += 1
+                if verbose:
+                    print("got %s (%s), should be %s (file: %s)" % (got_pattern.name, got_pattern.fname,
+                                                                   unknownGest.name, unknownGest.fname))
+
+        if ambiguous:
+            # the training set is loaded only if some samples are ambiguous
+            trn_set = self._train_set(fps, trn_set)
+            with self.comparison_scheduler(trn_set.gestures + tst_set.gestures) as scheduler:
+                tst_offset = len(trn_set)
+                pattern_ids = np.arange(len(trn_set))
+                for tst_id in ambiguous:
+                    costs, pruned = nearest_costs(scheduler, pattern_ids, tst_offset + tst_id, weighted, prune)
+                    comparisons += len(pattern_ids) - pruned
+                    fallbacks += 1
+                    got_pattern = trn_set[int(np.argmin(costs))]
+                    unknownGest = tst_set[tst_id]
+                    if got_pattern.name != unknownGest.name:
+                        errors += 1
+                        if verbose:
+                            print("got %s (file: %s), should be %s (file: %s)" % (
+                                got_pattern.name, got_pattern.fname, unknownGest.name, unknownGest.fname))
+
+        total_samples = len(tst_set)
+        print("*** ERRORS: %d; \t TOTAL SAMPLES: %d" % (errors, total_samples))
+        print("*** ambiguous: %d samples fell back to the nearest training sample" % fallbacks)
+        print("*** comparisons: %d (%.1f per sample)" % (comparisons, float(comparisons) / total_samples))
+        duration = time.time() - start
+        print("Duration: %d sec" % duration)
+
+        return errors, total_samples
+
+
     def error_vs_fps(self, mode, beta):
         """
          Plots the out-of-sample error VS fps.
@@ -300,8 +623,9 @@ class Testing(InstrumentCollector):
         fps_range = range(2, 11, 1)
         test_errors = []
         for fps in fps_range:
-            self.compute_weights(mode, beta, fps)
-            inf, sup, tot = self.the_worst_comparison(fps, verbose=False)
+            trn_set = self.load_train_set(fps)
+            self.compute_weights(mode, beta, fps, trn_set)
+            inf, sup, tot = self.the_worst_comparison(fps, verbose=False, trn_set=trn_set)
             Etest = float(sup) / tot
             test_errors.append(Etest)
         plt.plot(fps_range, test_errors, 'o--', ms=8)
@@ -340,50 +664,41 @@ class Testing(InstrumentCollector):
 
 class Training(InstrumentCollector):
 
-    def __init__(self, MotionClass, prefix=""):
-        InstrumentCollector.__init__(self, MotionClass, prefix)
+    def __init__(self, MotionClass, prefix="", workers=None, chunk_size=64, shared=True):
+        InstrumentCollector.__init__(self, MotionClass, prefix, workers, chunk_size, shared)
 
-    def compute_within_variance(self, fps, verbose=True):
+    def compute_within_variance(self, fps, verbose=True, trn_set=None):
         """
          Computes averaged within-class variance from the Training dataset.
          :param fps: frames per second to be set;
                      pass as None to use the default fps
          :param verbose: verbose display (True) or silent (False)
+         :param trn_set: training GestureDataset to be reused
          :return (float), averaged variance between two different samples
                           within the same class
         """
         self.load_info()
         print("%s: COMPUTING WITHIN VARIANCE" % self.MotionClass.__name__)
         start_timer = time.time()
+        trn_set = self._train_set(fps, trn_set)
 
-        executor = ProcessPoolExecutor()
-        one_vs_the_same_var = []
-        futures_list = []
-        for directory in os.listdir(self.trn_path):
-            trn_subfolder = os.path.join(self.trn_path, directory)
-            log_examples = os.listdir(trn_subfolder)
-            while len(log_examples) > 1:
-                first_log_path = os.path.join(trn_subfolder, log_examples[0])
-                firstGest = self.MotionClass(first_log_path, fps)
-                for another_log in log_examples[1:]:
-                    other_log_path = os.path.join(trn_subfolder, another_log)
-                    goingGest = self.MotionClass(other_log_path, fps)
+        pairs = []
+        for directory in trn_set.class_names:
+            class_ids = list(trn_set.class_indices(directory))
+            while len(class_ids) > 1:
+                first_id = class_ids[0]
+                for going_id in class_ids[1:]:
 
                     # since both firstGest and goingGest have the same weights
                     # (stored in PROJECTNAME_INFO.json), there is no need to
                     # alter arguments and compute it explicitly, because
                     # compare(goingGest, firstGest) == compare(firstGest, goingGest)
-                    future = executor.submit(compare, *(firstGest, goingGest, fastdtw, True))
-                    futures_list.append(future)
-
-                log_examples.pop(0)
+                    pairs.append((first_id, going_id))
 
-        results_collected = concurrent.futures.wait(futures_list)
-        assert len(results_collected.not_done) == 0, "failed to compute async"
+                class_ids.pop(0)
 
-        for future_completed in results_collected.done:
-            dist = future_completed.result()
-            one_vs_the_same_var.append(dist)
+        distances = self.distance_matrix(fps, trn_set)
+        one_vs_the_same_var = distances.get(pairs, self.comparison_scheduler, True, verbose).tolist()
 
         if any(one_vs_the_same_var):
             within_var = np.average(one_vs_the_same_var)
@@ -406,31 +721,28 @@ class Training(InstrumentCollector):
         return within_var
 
 
-    def compute_between_variance(self, fps, verbose=True):
+    def compute_between_variance(self, fps, verbose=True, trn_set=None):
         """
          Computes averaged between-class variance from the Training dataset.
          :param fps: frames per second to be set;
                      pass as None to use the default fps
          :param verbose: verbose display (True) or silent (False)
+         :param trn_set: training GestureDataset to be reused
          :return: (float), the averaged dist between two samples from different classes
         """
         print("%s: COMPUTING BETWEEN VARIANCE" % self.MotionClass.__name__)
         start_timer = time.time()
-        one_vs_others_var = []
-        trn_samples = self.load_train_samples(fps)
-        futures_list = []
-        with ProcessPoolExecutor() as executor:
-            for firstGest in trn_samples:
-                for goingGest in (trn_samples + tuple()):
-                    if firstGest.name != goingGest.name:
-                        future = executor.submit(compare, *(firstGest, goingGest, fastdtw, True))
-                        futures_list.append(future)
-
-            results_collected = concurrent.futures.wait(futures_list)
-            assert len(results_collected.not_done) == 0, "failed to compute async"
-            for future_completed in results_collected.done:
-                dist = future_completed.result()
-                one_vs_others_var.append(dist)
+        trn_set = self._train_set(fps, trn_set)
+        trn_samples = trn_set.gestures
+        pairs = []
+        for first_id, firstGest in enumerate(trn_samples):
+            for going_id, goingGest in enumerate(trn_samples):
+                if firstGest.name != goingGest.name:
+                    pairs.append((first_id, going_id))
+
+        # compare(a, b) != compare(b, a) for different classes weights
+        distances = self.distance_matrix(fps, trn_set)
+        one_vs_others_var = distances.get(pairs, self.comparison_scheduler, verbose=verbose)
 
         between_var = np.average(one_vs_others_var)
         between_std = np.std(one_vs_others_var)
@@ -448,7 +760,53 @@ class Training(InstrumentCollector):
         return between_var
 
 
-    def update_ratio(self, mode, beta, fps, verbose=False):
+    def build_prototypes(self, fps, per_class=1, iterations=10, verbose=True, trn_set=None):
+        """
+         Builds per_class averaged prototypes of each class with weighted DBA
+         (see tools/prototypes.py) and saves them to PROJECT_PROTOTYPES.npz.
+         Call it after the weights are chosen, since the class weights
+         (from PROJECT_INFO.json) are used both for the alignment and the prototypes.
+        :param fps: frames per second to be set;
+                    pass as None to use the default fps
+        :param per_class: number of prototypes per class
+        :param iterations: max number of DBA iterations
+        :param verbose: verbose display (True) or silent (False)
+        :param trn_set: training GestureDataset to be reused
+        :return: {class folder name: list of GestureRecord prototypes}
+        """
+        print("%s: BUILDING PROTOTYPES (%d per class)" % (self.MotionClass.__name__, per_class))
+        start_timer = time.time()
+        trn_set = self._train_set(fps, trn_set)
+
+        pairs = []
+        for directory in trn_set.class_names:
+            class_ids = trn_set.class_indices(directory)
+            pairs.extend((first_id, going_id) for first_id in class_ids for going_id in class_ids
+                         if first_id < going_id)
+
+        # medoids are chosen by the same class costs, which the within variance needs as well
+        distances = self.distance_matrix(fps, trn_set)
+        distances.get(pairs, self.comparison_scheduler, True, verbose)
+
+        prototypes = {}
+        for directory in trn_set.class_names:
+            class_ids = trn_set.class_indices(directory)
+            costs = distances.costs[np.ix_(class_ids, class_ids)]
+            prototypes[directory] = class_prototypes(trn_set.class_gestures(directory), costs,
+                                                     directory, per_class, iterations)
+            if verbose:
+                print("\t %s: %d prototypes out of %d samples" % (directory, len(prototypes[directory]),
+                                                                  len(class_ids)))
+        save_prototypes(prototypes, self.prototypes_path())
+
+        if verbose:
+            duration = time.time() - start_timer
+            print("Done with: \n\t %s \n\t duration: %d sec\n" % (self.prototypes_path(), duration))
+
+        return prototypes
+
+
+    def update_ratio(self, mode, beta, fps, verbose=False, trn_set=None, global_weights=None):
         """
          Updates weights, within and between variance for the given beta param.
         :param mode: defines moving markers
@@ -458,10 +816,17 @@ class Training(InstrumentCollector):
         :param fps: frames per second to be set;
                     pass as None to use the default fps
         :param verbose: verbose display (True) or silent (False)
+        :param trn_set: training GestureDataset to be reused
+        :param global_weights: aver weights for the beta, taken from weights_sweep;
+                               pass as None to compute them
         """
-        self.compute_weights(mode, beta, fps)
-        self.compute_within_variance(fps, verbose)
-        self.compute_between_variance(fps, verbose)
+        trn_set = self._train_set(fps, trn_set)
+        if global_weights is None:
+            self.compute_weights(mode, beta, fps, trn_set)
+        else:
+            self.save_weights(beta, global_weights, trn_set)
+        self.compute_within_variance(fps, verbose, trn_set)
+        self.compute_between_variance(fps, verbose, trn_set)
 
         within_var = self.proj_info["within_variance"]
         within_std = self.proj_info["within_std"]
@@ -495,9 +860,11 @@ class Training(InstrumentCollector):
         beta_range = 1e-6, 1e-3, 1e0, 1e1, 1e2, 1e3
         gained_ratios = []
         gained_rstds = []
-        for beta in beta_range:
+        trn_set = self.load_train_set(fps)
+        sweep = self.weights_sweep(mode, beta_range, fps, trn_set)
+        for beta, global_weights in zip(beta_range, sweep):
             print("BETA: %.1e" % beta)
-            self.update_ratio(mode, beta, fps)
+            self.update_ratio(mode, beta, fps, trn_set=trn_set, global_weights=global_weights)
             gained_ratios.append(self.proj_info["d-ratio"])
             gained_rstds.append(self.proj_info["d-ratio-std"])
 
@@ -548,10 +915,12 @@ class Training(InstrumentCollector):
             betas_left = beta_range[start:]
             print("Last computed beta was %.1e" % beta_range[start-1])
 
-        for beta in betas_left:
+        trn_set = self.load_train_set(fps)
+        sweep = self.weights_sweep(mode, betas_left, fps, trn_set)
+        for beta, global_weights in zip(betas_left, sweep):
             start_clock = time.ctime() + ":\t"
             print(start_clock + "PROCESSING BETA = %.1e" % beta)
-            self.update_ratio(mode, beta, fps, verbose=False)
+            self.update_ratio(mode, beta, fps, verbose=False, trn_set=trn_set, global_weights=global_weights)
 
             progress["wthnvars"].append(self.proj_info["within_variance"])
             progress["btwvars"].append(self.proj_info["between_variance"])
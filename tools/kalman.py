@@ -5,12 +5,16 @@ import numpy as np
 
 def kalman_1d(x_noisy, k_stab=0.2):
     """
-     Performs smoothing on a 1d-array.
+     Performs smoothing on a 1d-array frame by frame
+     (kept as a reference of kalman_filter).
     :param x_noisy: noisy 1d-array
     :param k_stab: kalman stable gain
     :return: optimal xs
     """
-    first_visible_id = ~np.isnan(x_noisy)[0]
+    visible = ~np.isnan(x_noisy)
+    if not visible.any():
+        return list(x_noisy)
+    first_visible_id = int(np.argmax(visible))
     start_val = x_noisy[first_visible_id]
     x_opt = [start_val] * (first_visible_id + 1)
     for frame in range(first_visible_id + 1, len(x_noisy)):
@@ -22,19 +26,60 @@ def kalman_1d(x_noisy, k_stab=0.2):
     return x_opt
 
 
-def kalman_filter(__data):
+class KalmanStream(object):
+    """
+     Kalman smoothing of live data, which comes by chunks of frames.
+     The filter state is kept between the chunks, so the filtered chunks
+     are the same as kalman_filter output on the whole data, except
+     the frames before the first visible one of a marker:
+     they stay NaN, since the first visible value isn't known yet.
+    """
+
+    def __init__(self, k_stab=0.2):
+        """
+        :param k_stab: kalman stable gain
+        """
+        self.k_stab = k_stab
+        # (#markers, #dim) last optimal xs; NaN till the first visible frame
+        self.state = None
+
+    def update(self, chunk):
+        """
+        :param chunk: (#markers, #frames, #dim) next frames
+        :return: (#markers, #frames, #dim) filtered frames
+        """
+        chunk = np.asarray(chunk, dtype=float)
+        if self.state is None:
+            self.state = np.full((chunk.shape[0], chunk.shape[2]), np.nan)
+        filtered = np.empty_like(chunk)
+        for frame in range(chunk.shape[1]):
+            x_noisy = chunk[:, frame, :]
+            visible = ~np.isnan(x_noisy)
+            x_opt = self.k_stab * x_noisy + (1. - self.k_stab) * self.state
+            # the first visible value starts the filter; invisible ones keep the last x_opt
+            x_opt = np.where(visible & np.isnan(self.state), x_noisy, x_opt)
+            self.state = np.where(visible, x_opt, self.state)
+            filtered[:, frame, :] = self.state
+        return filtered
+
+
+def kalman_filter(__data, k_stab=0.2):
     """
     :param __data: (#markers, #frames, #dim) gesture data
+    :param k_stab: kalman stable gain
     :return: filtered (smooth) gesture data
     """
     data = np.copy(__data)
     if data.shape[1] > 1:
-        for markerID in range(data.shape[0]):
-            for dim in range(data.shape[2]):
-                x_opt = kalman_1d(data[markerID, :, dim])
+        data = KalmanStream(k_stab).update(data)
 
-                # put NaNs back, if you want
-                # x_opt[np.isnan(data[markerID, ::]).any(axis=1)] = np.nan
+        # frames before the first visible one take its value
+        visible = ~np.isnan(data)
+        first_visible = np.argmax(visible, axis=1)[:, np.newaxis, :]
+        start_val = np.take_along_axis(data, first_visible, axis=1)
+        leading = np.arange(data.shape[1])[np.newaxis, :, np.newaxis] < first_visible
+        data = np.where(leading, start_val, data)
 
-                data[markerID, :, dim] = x_opt
+        # put NaNs back, if you want
+        # data[np.isnan(__data)] = np.nan
     return data
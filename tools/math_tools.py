@@ -3,22 +3,49 @@
 import numpy as np
 
 
-def diff(data, step=1):
+def _window_sums(data, width):
+    """
+     Sums over all windows of frames by the difference of cumulative sums.
+     NaNs are summed up as zeros and counted separately.
+    :param data: (#markers, #frames, #dim) data
+    :param width: window width in frames
+    :return: (#markers, #windows, #dim) sums and numbers of not NaN values
+             of windows data[:, i:i+width, :]
+    """
+    visible = ~np.isnan(data)
+    zeros_shape = data.shape[0], 1, data.shape[2]
+    sums = np.concatenate((np.zeros(zeros_shape), np.cumsum(np.where(visible, data, 0.), axis=1)), axis=1)
+    counts = np.concatenate((np.zeros(zeros_shape, dtype=int), np.cumsum(visible, axis=1)), axis=1)
+    windows = max(0, data.shape[1] - width + 1)
+    return sums[:, width:width + windows] - sums[:, :windows], counts[:, width:width + windows] - counts[:, :windows]
+
+
+def _window_averages(data, width, norm, ignore_nan):
+    """
+    :param data: (#markers, #frames, #dim) data
+    :param width: window width in frames
+    :param norm: window sum divider
+    :param ignore_nan: average over not NaN values only (True)
+                       or make a window with a NaN to be NaN (False)
+    :return: (#markers, #windows, #dim) averages of windows data[:, i:i+width, :]
+    """
+    sums, counts = _window_sums(data, width)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        if ignore_nan:
+            return sums / counts
+        return np.where(counts == width, sums / float(norm), np.nan)
+
+
+def diff(data, step=1, ignore_nan=False):
     """
     :param data: (#markers, #frames, 3) ndarray of 3d points data
     :param step: number of frames per step
+    :param ignore_nan: skip NaN differences (True) or return NaN for such ticks (False)
     :return: average differential of (data[i] - data[i-step]) / step
     """
-    new_shape = list(data.shape)
-    indices = np.arange(step, data.shape[1], step)
-    new_shape[1] = len(indices)
-    deriv_data = np.empty(shape=new_shape)
-    for tick in range(len(indices)):
-        frame = indices[tick]
-        _deriv = data[:, frame-step+1:frame, :] - data[:, frame-step:frame-1, :]
-        _deriv = np.average(_deriv, axis=1)
-        deriv_data[:, tick, :] = _deriv
-    return deriv_data
+    # tick at frame i averages the differences within data[i-step:i]
+    averages = _window_averages(np.diff(data, axis=1), step - 1, step - 1, ignore_nan)
+    return averages[:, :max(0, data.shape[1] - step):step, :]
 
 
 def moving_average_simple(xs, wsize=5):
@@ -35,18 +62,68 @@ def moving_average_simple(xs, wsize=5):
     return xs_smooth
 
 
-def moving_average(data, wsize=5):
+def moving_average(data, wsize=5, ignore_nan=False):
     """
     :param data: (#markers, #frames, 3) 3d points data
     :param wsize: (2n+1) window size for averaging
+    :param ignore_nan: average over not NaN values only (True)
+                       or make a window with a NaN to be NaN (False)
     :return: (#markers, #frames, 3) smooth data
     """
     step = int(wsize / 2)
-    new_shape = list(data.shape)
-    new_shape[1] -= 2 * step
-    data_smooth = np.empty(shape=new_shape)
-    for marker in range(data.shape[0]):
-        for ordinate in range(data.shape[2]):
-            xs = data[marker, :, ordinate]
-            data_smooth[marker, :, ordinate] = moving_average_simple(xs, wsize)
-    return data_smooth
\ No newline at end of file
+    return _window_averages(data, 2 * step + 1, wsize, ignore_nan)
+
+
+class MovingAverageStream(object):
+    """
+     moving_average of live data, which comes by chunks of frames.
+     The last frames are kept till their window is complete,
+     so the smoothed chunks make up moving_average of the whole data.
+    """
+
+    def __init__(self, wsize=5, ignore_nan=False):
+        """
+        :param wsize: (2n+1) window size for averaging
+        :param ignore_nan: see moving_average
+        """
+        self.wsize = wsize
+        self.ignore_nan = ignore_nan
+        self.tail = None
+
+    def update(self, chunk):
+        """
+        :param chunk: (#markers, #frames, 3) next frames
+        :return: (#markers, #smooth frames, 3) frames, which windows are complete by now
+        """
+        frames = chunk if self.tail is None else np.concatenate((self.tail, chunk), axis=1)
+        step = int(self.wsize / 2)
+        self.tail = frames[:, frames.shape[1] - min(2 * step, frames.shape[1]):, :]
+        return moving_average(frames, self.wsize, self.ignore_nan)
+
+
+class DiffStream(object):
+    """
+     diff of live data, which comes by chunks of frames.
+     The frames since the last tick are kept,
+     so the chunks ticks make up diff of the whole data.
+    """
+
+    def __init__(self, step=1, ignore_nan=False):
+        """
+        :param step: number of frames per step
+        :param ignore_nan: see diff
+        """
+        self.step = step
+        self.ignore_nan = ignore_nan
+        self.tail = None
+
+    def update(self, chunk):
+        """
+        :param chunk: (#markers, #frames, 3) next frames
+        :return: (#markers, #ticks, 3) ticks, which frames have come by now
+        """
+        frames = chunk if self.tail is None else np.concatenate((self.tail, chunk), axis=1)
+        ticks = diff(frames, self.step, self.ignore_nan)
+        # the tail starts at the last tick frame, i.e. step frames before the next one
+        self.tail = frames[:, ticks.shape[1] * self.step:, :]
+        return ticks
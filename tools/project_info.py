@@ -0,0 +1,102 @@
+# coding=utf-8
+
+#################################################################
+# Per-process registry of parsed json files (PROJECT_INFO.json, #
+# face structures, etc.). Each file is parsed once and reparsed #
+# only when its mtime or size change, or it's forgotten.       #
+#################################################################
+
+import os
+import sys
+import json
+
+import numpy as np
+
+# abs path --> (mtime, size), parsed content, {weights key: weights array}
+_registry = {}
+
+
+def _entry(json_path):
+    """
+    :param json_path: path to json file
+    :return: registry entry of the file, which is up to date
+    """
+    abs_path = os.path.abspath(json_path)
+    stat = os.stat(abs_path)
+    # coarse st_mtime may not change, when the file is rewritten quickly
+    state = getattr(stat, "st_mtime_ns", stat.st_mtime), stat.st_size
+    entry = _registry.get(abs_path)
+    if entry is None or entry[0] != state:
+        with open(abs_path, 'r') as json_file:
+            entry = state, json.load(json_file), {}
+        _registry[abs_path] = entry
+    return entry
+
+
+def forget(json_path):
+    """
+     Drops the registry entry of the file; call it after the file is rewritten.
+    :param json_path: path to json file
+    """
+    _registry.pop(os.path.abspath(json_path), None)
+
+
+# load_json default, which makes a missing file raise IOError
+REQUIRED = object()
+
+
+def load_json(json_path, default=None):
+    """
+    :param json_path: path to json file
+    :param default: what to return, if the file doesn't exist;
+                    pass REQUIRED to raise IOError instead
+    :return: parsed content, shared within the process (don't modify it)
+    """
+    try:
+        return _entry(json_path)[1]
+    except (IOError, OSError) as err:
+        if default is REQUIRED:
+            raise IOError("cannot read %s: %s" % (json_path, err))
+        return default
+
+
+def info_path(project):
+    """
+     PROJECT_INFO.json is looked for next to the running script
+     and then in its parent folder.
+    :param project: project name (Kinect, MoCap, Emotion)
+    :return: path to PROJECT_INFO.json
+    """
+    active_dirname = os.path.dirname(sys.argv[0])
+    json_file = project.upper() + "_INFO.json"
+    json_path = os.path.join(active_dirname, json_file)
+    if not os.path.exists(json_path):
+        json_path = os.path.join(os.path.dirname(active_dirname), json_file)
+    return json_path
+
+
+def get_weights(json_path, *keys):
+    """
+    :param json_path: path to json file with the "weights" section
+    :param keys: keys of the weights list within the "weights" section
+                 (gesture name or face area and action)
+    :return: (#markers,) weights array, ordered as the gesture labels,
+             or None, if the file doesn't provide them;
+             the array is shared within the process (don't modify it)
+    """
+    try:
+        _, content, weights_cache = _entry(json_path)
+    except (IOError, OSError):
+        return None
+    if keys not in weights_cache:
+        weights = content.get("weights", {})
+        for key in keys:
+            if key not in weights:
+                weights = None
+                break
+            weights = weights[key]
+        if weights is not None:
+            weights = np.array(weights, dtype=float)
+            weights.setflags(write=False)
+        weights_cache[keys] = weights
+    return weights_cache[keys]
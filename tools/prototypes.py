@@ -0,0 +1,139 @@
+# coding=utf-8
+
+####################################################################
+# Class prototypes: each class is represented by one or a few      #
+# averaged gestures, built with weighted DTW Barycenter Averaging  #
+# (DBA), so a query can be compared with O(#classes) prototypes    #
+# instead of every training sample.                                #
+####################################################################
+
+import json
+
+import numpy as np
+
+from tools.fastdtw import fastdtw
+from tools.record import GestureRecord
+
+
+def aligned_data(gest, labels):
+    """
+    :param gest: BasicMotion or GestureRecord instance
+    :param labels: markers names to be taken
+    :return: (#labels, #frames, #dim) gesture data; NaN for absent markers
+    """
+    data = np.full((len(labels),) + gest.norm_data.shape[1:], np.nan)
+    for marker_id, marker in enumerate(labels):
+        if marker in gest.labels:
+            data[marker_id] = gest.norm_data[gest.labels.index(marker)]
+    return data
+
+
+def dba(samples, init, weights, iterations=10, radius=1, tolerance=1e-6):
+    """
+     Weighted DTW Barycenter Averaging.
+     Each iteration aligns the samples to the current average with weighted FastDTW
+     and moves each average frame to the mean of the sample frames aligned to it.
+    :param samples: list of (#markers, #frames, #dim) data
+    :param init: (#markers, #frames, #dim) initial average (e.g. the class medoid)
+    :param weights: (#markers,) markers weights
+    :param iterations: max number of iterations
+    :param radius: FastDTW radius
+    :param tolerance: stop when no average coord moves more than that
+    :return: (#markers, #frames, #dim) averaged data
+    """
+    average = np.array(init, dtype=float)
+    for _ in range(iterations):
+        sums = np.zeros(average.shape)
+        counts = np.zeros(average.shape[:2])
+        for data in samples:
+            _, path = fastdtw(average, data, weights, radius)
+            average_ids, data_ids = np.array(path).T
+            aligned = data[:, data_ids, :]
+            visible = ~np.isnan(aligned).any(axis=2)
+            np.add.at(sums, (slice(None), average_ids), np.where(visible[..., np.newaxis], aligned, 0.))
+            np.add.at(counts, (slice(None), average_ids), visible)
+        with np.errstate(invalid="ignore"):
+            # markers, which are never visible, stay NaN
+            updated = sums / counts[..., np.newaxis]
+        shift = np.abs(updated - average)
+        average = updated
+        if not (shift > tolerance).any():
+            break
+    return average
+
+
+def choose_medoids(costs, number):
+    """
+     Farthest-first choice of medoids: the first is the class medoid,
+     the next ones are the farthest from the chosen ones.
+    :param costs: (#samples, #samples) symmetric comparison costs
+    :param number: max number of medoids
+    :return: medoid ids, (#samples,) ids of the nearest medoid for each sample
+    """
+    medoids = [int(np.argmin(np.sum(costs, axis=1)))]
+    while len(medoids) < min(number, len(costs)):
+        nearest_cost = np.min(costs[:, medoids], axis=1)
+        medoids.append(int(np.argmax(nearest_cost)))
+    groups = np.argmin(costs[:, medoids], axis=1)
+    groups[medoids] = np.arange(len(medoids))
+    return medoids, groups
+
+
+def class_prototypes(gestures, costs, directory, number=1, iterations=10):
+    """
+    :param gestures: gestures of the class (with the class weights)
+    :param costs: (#gestures, #gestures) symmetric comparison costs of the gestures
+    :param directory: class folder name
+    :param number: number of prototypes per class
+    :param iterations: max number of DBA iterations
+    :return: list of GestureRecord prototypes
+    """
+    medoids, groups = choose_medoids(costs, number)
+    prototypes = []
+    for group_id, medoid_id in enumerate(medoids):
+        medoid = gestures[medoid_id]
+        samples = [aligned_data(gestures[ind], medoid.labels) for ind in np.where(groups == group_id)[0]]
+        weights = medoid.get_weights()
+        average = dba(samples, medoid.norm_data, weights, iterations)
+        fname = "%s prototype %d" % (directory, group_id)
+        prototypes.append(GestureRecord(medoid.name, medoid.labels, average, weights, medoid.fps, fname))
+    return prototypes
+
+
+def save_prototypes(prototypes, path):
+    """
+    :param prototypes: {class folder name: list of GestureRecord prototypes}
+    :param path: path to .npz-file
+    """
+    index = []
+    arrays = {}
+    for directory in sorted(prototypes):
+        for proto in prototypes[directory]:
+            array_name = "proto_%d" % len(index)
+            arrays[array_name] = proto.norm_data
+            index.append({
+                "class": directory,
+                "array": array_name,
+                "name": proto.name,
+                "fname": proto.fname,
+                "labels": list(proto.labels),
+                "weights": proto.weights.tolist(),
+                "fps": proto.fps,
+            })
+    with open(path, 'wb') as proto_file:
+        np.savez(proto_file, index=np.array(json.dumps(index)), **arrays)
+
+
+def load_prototypes(path):
+    """
+    :param path: path to .npz-file, made by save_prototypes
+    :return: {class folder name: list of GestureRecord prototypes}
+    """
+    prototypes = {}
+    with open(path, 'rb') as proto_file:
+        npz = np.load(proto_file)
+        for item in json.loads(str(npz["index"])):
+            proto = GestureRecord(item["name"], item["labels"], npz[item["array"]],
+                                  item["weights"], item["fps"], item["fname"])
+            prototypes.setdefault(item["class"], []).append(proto)
+    return prototypes
@@ -0,0 +1,175 @@
+# coding=utf-8
+
+##############################################################################
+# Online recognition of gestures in a stream of frames.                      #
+# Each class template is matched against the stream with the subsequence     #
+# weighted DTW (SPRING), which keeps only one cost column per template,      #
+# so the memory doesn't grow with the stream.                                #
+# SPRING theory:                                                             #
+#   http://www.cs.cmu.edu/~christos/PUBLICATIONS/icde07-spring.pdf           #
+##############################################################################
+
+from collections import namedtuple
+
+import numpy as np
+
+from tools.fastdtw import dist_matrix
+
+# gesture of the class name, found in the stream frames [start, end]
+# with the given (path length normalized) cost
+Detection = namedtuple("Detection", ("name", "start", "end", "cost", "template"))
+
+
+class SpringTemplate(object):
+    """
+     Subsequence weighted DTW of a known gesture against a stream.
+     cost[i] is the cost of the best warping path, which ends at the current
+     frame and the i-th template frame and may start at any stream frame.
+     As in compare, only the known gesture weights are used, and the cost
+     is normalized by the path length to be compared to the threshold.
+    """
+
+    def __init__(self, gest, labels, threshold, max_latency=None):
+        """
+        :param gest: known gesture (BasicMotion or GestureRecord instance)
+        :param labels: markers names of the stream frames
+        :param threshold: max normalized cost of a detection
+        :param max_latency: max number of frames a detection is held for
+                            to be improved by overlapping paths;
+                            pass None to use the template length
+        """
+        known_ids = [marker_id for marker_id, marker in enumerate(gest.labels) if marker in labels]
+        self.stream_ids = [labels.index(gest.labels[marker_id]) for marker_id in known_ids]
+        self.data = gest.norm_data[known_ids]
+        self.weights = gest.get_weights()[known_ids]
+        if len(known_ids) < len(gest.labels):
+            # the same as take_common_markers does
+            self.weights /= np.nansum(self.weights)
+        self.name = gest.name
+        self.fname = gest.fname
+        self.threshold = threshold
+        frames = self.data.shape[1]
+        self.max_latency = frames if max_latency is None else max_latency
+        self.costs = np.repeat(np.inf, frames)
+        self.lengths = np.zeros(frames, dtype=int)
+        self.starts = np.zeros(frames, dtype=int)
+        self.positions = np.arange(frames)
+        # (cost, start, end) of the best path found, which isn't reported yet
+        self.candidate = None
+
+    def reset(self):
+        """
+         Forgets the stream frames.
+        """
+        self.costs[:] = np.inf
+        self.candidate = None
+
+    def step(self, dist, frame_id):
+        """
+         Moves the cost column to the next frame.
+        :param dist: (#template frames,) dist of the frame to the template frames
+        :param frame_id: stream id of the frame
+        :return: Detection or None
+        """
+        # the paths are continued from the previous frame by the diagonal (the preceding
+        # template frame) or horizontal (the same template frame) step;
+        # a new path starts at the first template frame with zero cost
+        diag_costs = np.concatenate(([0.], self.costs[:-1]))
+        diag_lengths = np.concatenate(([0], self.lengths[:-1]))
+        diag_starts = np.concatenate(([frame_id], self.starts[:-1]))
+        is_diag = diag_costs <= self.costs
+        prev_costs = np.where(is_diag, diag_costs, self.costs)
+        prev_lengths = np.where(is_diag, diag_lengths, self.lengths)
+        prev_starts = np.where(is_diag, diag_starts, self.starts)
+
+        # vertical steps (along the template within the frame) unroll into
+        # cost[i] = min_k(prev_costs[k] + sum(dist[k:i+1])), which is a running min
+        cum_dist = np.cumsum(dist)
+        entries = prev_costs - (cum_dist - dist)
+        best_entries = np.minimum.accumulate(entries)
+        entry_ids = np.maximum.accumulate(np.where(entries <= best_entries, self.positions, 0))
+        self.costs = cum_dist + best_entries
+        self.lengths = prev_lengths[entry_ids] + self.positions - entry_ids + 1
+        self.starts = prev_starts[entry_ids]
+
+        detection = None
+        norm_costs = self.costs / self.lengths
+        if self.candidate is not None:
+            cost, start, end = self.candidate
+            # the candidate is reported, when no path overlapping it can beat it
+            overlapping = self.starts <= end
+            if not (overlapping & (norm_costs < cost)).any() or frame_id - end > self.max_latency:
+                detection = Detection(self.name, start, end, cost, self.fname)
+                self.costs[overlapping] = np.inf
+                norm_costs[overlapping] = np.inf
+                self.candidate = None
+        if norm_costs[-1] <= self.threshold and (self.candidate is None or norm_costs[-1] < self.candidate[0]):
+            self.candidate = norm_costs[-1], self.starts[-1], frame_id
+        return detection
+
+    def update(self, chunk, frame_ids):
+        """
+        :param chunk: (#stream markers, #frames, #dim) normalized stream frames
+        :param frame_ids: (#frames,) stream ids of the frames
+        :return: list of Detection
+        """
+        detections = []
+        dist = dist_matrix(self.data, chunk[self.stream_ids], self.weights)
+        for col, frame_id in enumerate(frame_ids):
+            detection = self.step(dist[:, col], frame_id)
+            if detection is not None:
+                detections.append(detection)
+        return detections
+
+
+class StreamingRecognizer(object):
+    """
+     Finds gestures of the templates classes in a stream, which comes by chunks of frames.
+     Per frame, it takes O(#templates * template length) time, and its memory
+     doesn't depend on the stream length.
+     The stream frames are to be normalized the same way as the templates
+     (see HumanoidNormStream for Kinect and MoCap projects).
+    """
+
+    def __init__(self, templates, labels, fps, thresholds, max_latency=None):
+        """
+        :param templates: known gestures (e.g. the class prototypes) of the same fps
+        :param labels: markers names of the stream frames
+        :param fps: stream frames per second (not less than the templates fps)
+        :param thresholds: max normalized cost of a detection (float)
+                           or {class name: max normalized cost}
+        :param max_latency: see SpringTemplate
+        """
+        self.templates_fps = templates[0].fps
+        assert all(gest.fps == self.templates_fps for gest in templates), "templates fps differ"
+        assert fps >= self.templates_fps, "stream fps is less than the templates fps"
+        if not isinstance(thresholds, dict):
+            thresholds = dict((gest.name, thresholds) for gest in templates)
+        self.templates = [SpringTemplate(gest, labels, thresholds[gest.name], max_latency)
+                          for gest in templates]
+        self.fps = fps
+        self.frames = 0
+
+    def reset(self):
+        """
+         Forgets the stream frames.
+        """
+        for template in self.templates:
+            template.reset()
+        self.frames = 0
+
+    def update(self, chunk):
+        """
+        :param chunk: (#markers, #frames, #dim) next normalized frames
+        :return: list of Detection, sorted by the end frame;
+                 start and end are the stream frames ids
+        """
+        frame_ids = self.frames + np.arange(chunk.shape[1])
+        self.frames += chunk.shape[1]
+        # the stream is thinned out to the templates fps
+        kept = (frame_ids * self.templates_fps // self.fps) != ((frame_ids - 1) * self.templates_fps // self.fps)
+        chunk = np.asarray(chunk, dtype=float)[:, kept]
+        detections = []
+        for template in self.templates:
+            detections.extend(template.update(chunk, frame_ids[kept]))
+        return sorted(detections, key=lambda detection: (detection.end, detection.cost))
@@ -0,0 +1,69 @@
+# coding=utf-8
+
+import numpy as np
+
+
+class GestureRecord(object):
+    """
+     Compact gesture, which holds only what the recognition needs.
+     Unlike BasicMotion, it has no raw data, plotting state
+     or per-marker dicts, and it is cheap to pickle.
+    """
+    __slots__ = ("name", "fname", "labels", "norm_data", "weights", "fps")
+
+    def __init__(self, name, labels, norm_data, weights, fps, fname=""):
+        """
+        :param name: class name of the gesture
+        :param labels: markers names
+        :param norm_data: (#markers, #frames, #dim) normalized data
+        :param weights: (#markers,) markers weights, ordered as labels
+        :param fps: frames per second
+        :param fname: source file name
+        """
+        self.name = name
+        self.fname = fname
+        self.labels = tuple(labels)
+        self.norm_data = norm_data
+        self.weights = np.asarray(weights, dtype=float)
+        self.fps = fps
+
+    @classmethod
+    def from_motion(cls, gest, dtype=np.float64):
+        """
+        :param gest: BasicMotion instance (HumanoidKinect, HumanoidUkr, Emotion, etc.)
+        :param dtype: norm_data type to be kept; pass np.float32 to halve the memory
+        :return: GestureRecord of the gesture
+        """
+        return cls(gest.name, gest.labels, np.asarray(gest.norm_data, dtype=dtype),
+                   gest.get_weights(), gest.fps, gest.fname)
+
+    def __getstate__(self):
+        return tuple(getattr(self, field) for field in self.__slots__)
+
+    def __setstate__(self, state):
+        for field, value in zip(self.__slots__, state):
+            setattr(self, field, value)
+
+    @property
+    def frames(self):
+        return self.norm_data.shape[1]
+
+    def get_norm_data(self):
+        """
+        :return: (#markers, #frames, #dim) normalized data
+        """
+        return np.copy(self.norm_data)
+
+    def get_weights(self):
+        """
+        :return: (#markers,) array of weights
+        """
+        return np.copy(self.weights)
+
+    def get_ids(self, *args):
+        """
+         Gets specific data ids by marker_names keys.
+        :param marker_names: list of keys
+        :return: data ids, w.r.t. marker_names
+        """
+        return tuple(self.labels.index(marker) for marker in args)
@@ -0,0 +1,138 @@
+# coding=utf-8
+
+##################################################################
+# Parallel gestures comparison: the gestures are sent to workers #
+# once (by a pool initializer) or shared with them through       #
+# a SharedGestureStore, and then only chunks of index pairs      #
+# go through the pipes.                                          #
+##################################################################
+
+from multiprocessing import Pool, cpu_count
+
+import numpy as np
+
+from tools.comparison import compare
+from tools.fastdtw import fastdtw
+from tools.gesture_store import SharedGestureStore, attach, shared_memory
+from tools.record import GestureRecord
+
+# gestures, held by a worker process
+_worker_gestures = ()
+
+# shared memory block, the worker gestures are attached to
+_worker_block = None
+
+
+def _init_worker(gestures):
+    """
+     Pool initializer: keeps the gestures in the worker process.
+    :param gestures: gestures to be compared
+    """
+    global _worker_gestures
+    _worker_gestures = gestures
+
+
+def _init_shared_worker(layout):
+    """
+     Pool initializer: attaches the worker to the shared gestures.
+    :param layout: SharedGestureStore layout
+    """
+    global _worker_block, _worker_gestures
+    _worker_block, _worker_gestures = attach(layout)
+
+
+def _compare_pairs(gestures, pairs, weighted, upper_bound):
+    """
+    :param gestures: gestures to be compared
+    :param pairs: (#pairs, 2) known and unknown gestures ids
+    :param weighted: use weighted FastDTW modification or just FastDTW
+    :param upper_bound: the cost to be beaten (see compare)
+    :return: (#pairs,) comparison costs
+    """
+    costs = np.empty(len(pairs))
+    for ind, (known_id, unknown_id) in enumerate(pairs):
+        costs[ind] = compare(gestures[known_id], gestures[unknown_id], fastdtw, weighted, upper_bound)
+    return costs
+
+
+def _compare_chunk(args):
+    """
+     Worker job: compares a chunk of pairs of the worker gestures.
+    :param args: pairs, weighted, upper_bound
+    :return: (#pairs,) comparison costs
+    """
+    return _compare_pairs(_worker_gestures, *args)
+
+
+class ComparisonScheduler(object):
+    """
+     Computes comparison costs of gestures pairs in parallel.
+     The gestures are sent to (or shared with) the workers on creation,
+     so create a new scheduler after their weights are changed.
+    """
+
+    def __init__(self, gestures, workers=None, chunk_size=64, shared=True):
+        """
+        :param gestures: gestures to be compared (referred to by their ids)
+        :param workers: number of worker processes;
+                        pass as None to use all cpu;
+                        pass 0 to compare serially in the current process (for debugging)
+        :param chunk_size: max number of pairs to be sent to a worker at once
+        :param shared: share the gestures data with the workers through
+                       a single shared memory block (if available)
+                       instead of sending each worker its own copy
+        """
+        self.gestures = tuple(gestures)
+        self.workers = cpu_count() if workers is None else workers
+        self.chunk_size = chunk_size
+        self.pool = None
+        self.store = None
+        if self.workers > 0:
+            if shared and shared_memory is not None:
+                self.store = SharedGestureStore(self.gestures)
+                try:
+                    self.pool = Pool(self.workers, initializer=_init_shared_worker, initargs=(self.store.layout,))
+                except BaseException:
+                    # close() is never reached, if the scheduler isn't built
+                    self.store.close()
+                    self.store = None
+                    raise
+            else:
+                records = tuple(GestureRecord.from_motion(gest) for gest in self.gestures)
+                self.pool = Pool(self.workers, initializer=_init_worker, initargs=(records,))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def close(self):
+        """
+         Shuts the workers down.
+        """
+        if self.pool is not None:
+            self.pool.close()
+            self.pool.join()
+            self.pool = None
+        if self.store is not None:
+            self.store.close()
+            self.store = None
+
+    def costs(self, pairs, weighted=True, upper_bound=np.inf):
+        """
+        :param pairs: (#pairs, 2) known and unknown gestures ids
+        :param weighted: use weighted FastDTW modification or just FastDTW
+        :param upper_bound: the cost to be beaten (see compare)
+        :return: (#pairs,) comparison costs
+        """
+        pairs = np.array(pairs, dtype=int).reshape(-1, 2)
+        if len(pairs) == 0:
+            return np.empty(0)
+        if self.pool is None:
+            return _compare_pairs(self.gestures, pairs, weighted, upper_bound)
+        # small jobs are spread among all the workers as well
+        chunk = max(1, min(self.chunk_size, -(-len(pairs) // self.workers)))
+        jobs = [(pairs[start:start + chunk], weighted, upper_bound)
+                for start in range(0, len(pairs), chunk)]
+        return np.concatenate(self.pool.map(_compare_chunk, jobs))